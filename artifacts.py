@@ -0,0 +1,121 @@
+from dataclasses import dataclass, fields, is_dataclass
+from typing import Any, Callable
+import hashlib
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from sdf import SDF
+from cloud import Cloud
+from triangulate import Mesh
+
+
+def canonical(value: Any) -> str:
+    """A text form of `value` that is the same in every run.
+
+    Dataclasses (SDF nodes, `Compiled`, `VoxelCache`, ...) are written as their
+    class and init fields, so derived caches do not matter. Functions are
+    named by module and qualified name, which only identifies module-level
+    functions; anything without a stable form raises `TypeError`.
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return repr(value)
+    if isinstance(value, (tuple, list)):
+        return "(" + ",".join(canonical(v) for v in value) + ")"
+    if isinstance(value, dict):
+        items = sorted((canonical(k), canonical(v)) for k, v in value.items())
+        return "{" + ",".join(f"{k}:{v}" for k, v in items) + "}"
+    if isinstance(value, np.ndarray):
+        digest = hashlib.sha256(np.ascontiguousarray(value).tobytes()).hexdigest()
+        return f"array({value.dtype.str},{value.shape},{digest})"
+    if isinstance(value, np.generic):
+        return canonical(value.item())
+    if is_dataclass(value) and not isinstance(value, type):
+        cls = type(value)
+        parts = [
+            f"{f.name}={canonical(getattr(value, f.name))}"
+            for f in fields(value)
+            if f.init
+        ]
+        return f"{cls.__module__}.{cls.__qualname__}(" + ",".join(parts) + ")"
+    qualname = getattr(value, "__qualname__", None)
+    if callable(value) and qualname is not None and "<" not in qualname:
+        return f"{value.__module__}.{qualname}"
+    raise TypeError(f"No stable fingerprint for {value!r}")
+
+
+def fingerprint(*parts: Any) -> str:
+    """Hex digest identifying an SDF tree together with stage parameters."""
+    return hashlib.sha256(canonical(parts).encode()).hexdigest()[:32]
+
+
+@dataclass
+class ArtifactCache:
+    """Arrays computed by pipeline stages, stored under `root` by fingerprint.
+
+    Each artifact is a directory of .npy files, one per array, loaded back
+    memory-mapped and read-only. Artifacts are written to a temporary
+    directory and renamed into place, so readers never see partial ones.
+    """
+
+    root: str = ".artifacts"
+
+    def path(self, stage: str, key: str) -> str:
+        return os.path.join(self.root, f"{stage}-{key}")
+
+    def load(self, stage: str, key: str) -> dict[str, np.ndarray] | None:
+        path = self.path(stage, key)
+        if not os.path.isdir(path):
+            return None
+        return {
+            name[: -len(".npy")]: np.load(os.path.join(path, name), mmap_mode="r")
+            for name in sorted(os.listdir(path))
+            if name.endswith(".npy")
+        }
+
+    def store(self, stage: str, key: str, arrays: dict[str, np.ndarray]) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=self.root, prefix=f".{stage}-")
+        try:
+            for name, array in arrays.items():
+                np.save(os.path.join(tmp, f"{name}.npy"), np.asarray(array))
+            os.rename(tmp, self.path(stage, key))
+        except OSError:
+            # Another process stored the same artifact first.
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.isdir(self.path(stage, key)):
+                raise
+
+    def arrays(
+        self, stage: str, key: str, compute: Callable[[], dict[str, np.ndarray]]
+    ) -> dict[str, np.ndarray]:
+        """The stored artifact, computing and storing it first if missing."""
+        arrays = self.load(stage, key)
+        if arrays is None:
+            self.store(stage, key, compute())
+            arrays = self.load(stage, key)
+        return arrays
+
+    def cloud(
+        self, stage: str, key: str, sdf: SDF, compute: Callable[[], Cloud]
+    ) -> Cloud:
+        def arrays() -> dict[str, np.ndarray]:
+            cloud = compute()
+            return {
+                "positions": cloud.positions,
+                "normals": cloud.normals,
+                "directions": cloud.directions,
+            }
+
+        a = self.arrays(stage, key, arrays)
+        return Cloud(sdf, a["positions"], a["normals"], a["directions"])
+
+    def mesh(self, stage: str, key: str, compute: Callable[[], Mesh]) -> Mesh:
+        def arrays() -> dict[str, np.ndarray]:
+            mesh = compute()
+            return {"triangles": mesh.triangles, "areas": mesh.areas}
+
+        a = self.arrays(stage, key, arrays)
+        return Mesh(a["triangles"], a["areas"])
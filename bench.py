@@ -0,0 +1,334 @@
+"""Time every pipeline stage on fixed scenes and compare against a baseline.
+
+    python bench.py                       # all scenes, stages and sizes
+    python bench.py --stage render --repeat 1
+    python bench.py --baseline bench_baseline.json
+
+Results are written as JSON (bench.json by default). Keep a run as the
+baseline by copying its output; later runs compare against it and exit with
+status 1 if any benchmark got slower than `--threshold`.
+"""
+
+from argparse import ArgumentParser
+from dataclasses import asdict, dataclass
+from functools import cache
+from math import cos, pi, sin
+from random import seed
+from time import perf_counter
+from typing import Any, Callable
+import json
+import os
+import platform
+import statistics
+import sys
+
+import numpy as np
+
+from sdf import SDF, bound, evaluate, evaluate_gradient, value_and_gradient
+from sdf import rotated, shifted, smooth_union, sphere, torus, union_all
+from codegen import Compiled, compile_sdf
+from ray import Ray
+from point import cross, normalize
+from geo import connect
+from cloud import Cloud, create_cloud
+from triangulate import Mesh, triangulate
+from stippling import make_surface, poisson_disk, stipple
+from render import render, ray_directions
+import instrument
+
+# Camera of render.py, looking at the origin from above.
+ORIGIN = (0, 3, 4)
+DIRECTION = normalize((0, -3, -4))
+UP = (0, 0, 1)
+EPS = 1e-3
+MAX_DISTANCE = 100.0
+# Cloud relaxation of render.py, also used for the inputs of later stages.
+CLOUD_PARAMS = {"near_dist": 0.7, "num_steps": 100, "step_size": 0.02}
+
+
+def tori() -> SDF:
+    """The compiled smooth union of two linked tori from render.py."""
+    return compile_sdf(
+        smooth_union(
+            shifted(torus(1, 0.5), (-1, 0, 0)),
+            shifted(rotated(torus(1, 0.5), (1, 0, 0), pi / 2), (1, 0, 0)),
+            0.5,
+        )
+    )
+
+
+def ball() -> SDF:
+    return sphere((0, 0, 0), 1)
+
+
+def beads() -> SDF:
+    """A wavy ring of 48 overlapping spheres, as a `union_all` tree."""
+    n = 48
+    return union_all(
+        [
+            sphere(
+                (
+                    1.5 * cos(2 * pi * i / n),
+                    1.5 * sin(2 * pi * i / n),
+                    0.3 * sin(6 * pi * i / n),
+                ),
+                0.35,
+            )
+            for i in range(n)
+        ]
+    )
+
+
+SCENES: dict[str, Callable[[], SDF]] = {"tori": tori, "sphere": ball, "beads": beads}
+
+
+@cache
+def scene(name: str) -> SDF:
+    return SCENES[name]()
+
+
+@cache
+def cloud(name: str, num_points: int) -> Cloud:
+    return create_cloud(scene(name), num_points, **CLOUD_PARAMS)
+
+
+@cache
+def mesh(name: str, num_points: int) -> Mesh:
+    return triangulate(cloud(name, num_points), near_dist=0.7)
+
+
+def bench_evaluate(name: str, size: int) -> Callable[[], Any]:
+    """`size` points uniformly in the bounding box, evaluated in one batch."""
+    b = bound(scene(name))
+    rng = np.random.default_rng(0)
+    ps = np.asarray(b.center) + rng.uniform(-b.radius, b.radius, (size, 3))
+    return lambda: evaluate(scene(name), ps)
+
+
+def bench_propagate(name: str, size: int) -> Callable[[], Any]:
+    """`size` x `size` camera rays, marched one `Ray.propagate` at a time."""
+    right = normalize(cross(DIRECTION, UP))
+    up = normalize(cross(right, DIRECTION))
+    offsets = np.arange(size) - size // 2
+    directions = ray_directions(DIRECTION, right, up, size, offsets, offsets)
+    rays = [Ray(ORIGIN, tuple(d)) for d in directions.reshape(-1, 3).tolist()]
+    return lambda: [r.propagate(scene(name), EPS, MAX_DISTANCE) for r in rays]
+
+
+def bench_render(name: str, size: int) -> Callable[[], Any]:
+    """A `size` x `size` render with a single process, without overlays."""
+    return lambda: render(
+        scene(name),
+        origin=ORIGIN,
+        direction=DIRECTION,
+        up=UP,
+        width=size,
+        height=size,
+        focal_length=size,
+        eps=EPS,
+        max_distance=MAX_DISTANCE,
+        points=[],
+        marks=[],
+        triangles=[],
+        processes=1,
+    )
+
+
+def bench_create_cloud(name: str, size: int) -> Callable[[], Any]:
+    return lambda: create_cloud(scene(name), size, **CLOUD_PARAMS)
+
+
+def bench_create_cloud_jacobi(name: str, size: int) -> Callable[[], Any]:
+    return lambda: create_cloud(scene(name), size, **CLOUD_PARAMS, jacobi=True)
+
+
+def bench_triangulate(name: str, size: int) -> Callable[[], Any]:
+    """Advancing front over a relaxed cloud; it can fail on sparser ones."""
+    points = cloud(name, size)
+    return lambda: triangulate(points, near_dist=0.7)
+
+
+def bench_stipple(name: str, size: int) -> Callable[[], Any]:
+    """`size` points from 50 random targets each, on the mesh of 300 points."""
+    surface = make_surface(scene(name), cloud(name, 300), mesh(name, 300))
+
+    def run() -> Cloud:
+        seed(0)
+        return stipple(surface, size, 50 * size)
+
+    return run
+
+
+def bench_poisson_disk(name: str, size: int) -> Callable[[], Any]:
+    """`size` blue noise points on the mesh of 300 points."""
+    surface = make_surface(scene(name), cloud(name, 300), mesh(name, 300))
+    return lambda: poisson_disk(surface, num_points=size, rng=0)
+
+
+def bench_connect(name: str, size: int) -> Callable[[], Any]:
+    """`connect` between `size` fixed pairs of cloud points."""
+    points = cloud(name, 300).positions
+    rng = np.random.default_rng(0)
+    pairs = rng.choice(len(points), (size, 2), replace=False)
+    pairs = [(tuple(points[i].tolist()), tuple(points[j].tolist())) for i, j in pairs]
+    return lambda: [connect(scene(name), p, q) for p, q in pairs]
+
+
+# Benchmarks by stage, with the sizes each is run at.
+STAGES: dict[str, tuple[Callable[[str, int], Callable[[], Any]], tuple[int, ...]]] = {
+    "evaluate": (bench_evaluate, (1_000, 100_000)),
+    "propagate": (bench_propagate, (16, 48)),
+    "render": (bench_render, (64, 160)),
+    "create_cloud": (bench_create_cloud, (100, 300)),
+    "create_cloud_jacobi": (bench_create_cloud_jacobi, (300, 1000)),
+    "triangulate": (bench_triangulate, (200, 300)),
+    "stipple": (bench_stipple, (50, 200)),
+    "poisson_disk": (bench_poisson_disk, (200, 2000)),
+    "connect": (bench_connect, (4, 16)),
+}
+
+
+def check_counts(sdf: SDF, size: int = 100) -> None:
+    """Check that `size` points count as `size` evaluations and gradients.
+
+    Nodes call their children without counting, so the counts do not depend
+    on the depth of the tree or on culling.
+    """
+    b = bound(sdf)
+    rng = np.random.default_rng(0)
+    ps = np.asarray(b.center) + rng.uniform(-b.radius, b.radius, (size, 3))
+    metrics = instrument.Metrics()
+    with instrument.recording(metrics):
+        evaluate(sdf, ps)
+        evaluate_gradient(sdf, ps)
+        for p in ps.tolist():
+            value_and_gradient(sdf, tuple(p))
+    expected = {"sdf.evaluations": size, "sdf.gradients": 2 * size}
+    if metrics.counters != expected:
+        raise AssertionError(f"{size} points counted as {metrics.counters}")
+
+
+@dataclass
+class Result:
+    scene: str
+    stage: str
+    size: int
+    best: float
+    median: float
+    repeat: int
+
+    @property
+    def key(self) -> tuple[str, str, int]:
+        return self.scene, self.stage, self.size
+
+
+def measure(scene_name: str, stage: str, size: int, repeat: int) -> Result:
+    """Best and median wall time of `repeat` runs; setup is not timed."""
+    make, _ = STAGES[stage]
+    run = make(scene_name, size)
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        run()
+        times.append(perf_counter() - start)
+    return Result(scene_name, stage, size, min(times), statistics.median(times), repeat)
+
+
+def compare(
+    results: list[Result], baseline: list[Result], threshold: float, min_delta: float
+) -> list[Result]:
+    """Print each result against the baseline; return the ones that regressed.
+
+    A regression is a best time over `threshold` times the baseline's and at
+    least `min_delta` seconds slower, so timer noise on tiny runs does not count.
+    """
+    before = {r.key: r for r in baseline}
+    regressions = []
+    for r in results:
+        old = before.get(r.key)
+        if old is None:
+            print(f"{r.scene:>8} {r.stage:>19} {r.size:>7}  {r.best:9.4f}s  (new)")
+            continue
+        ratio = r.best / old.best
+        flag = ""
+        if ratio > threshold and r.best - old.best >= min_delta:
+            flag = "  SLOWER"
+            regressions.append(r)
+        elif ratio < 1 / threshold:
+            flag = "  faster"
+        print(
+            f"{r.scene:>8} {r.stage:>19} {r.size:>7}  {r.best:9.4f}s"
+            f"  vs {old.best:9.4f}s  x{ratio:5.2f}{flag}"
+        )
+    return regressions
+
+
+def main() -> int:
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scene", action="append", choices=SCENES)
+    parser.add_argument("--stage", action="append", choices=STAGES)
+    parser.add_argument("--size", choices=("small", "large", "all"), default="all")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default="bench.json")
+    parser.add_argument("--baseline", default="bench_baseline.json")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.25,
+        help="slowdown ratio of the best time that counts as a regression",
+    )
+    parser.add_argument(
+        "--min-delta",
+        type=float,
+        default=1e-3,
+        help="smallest slowdown in seconds that counts as a regression",
+    )
+    args = parser.parse_args()
+
+    for scene_name in args.scene or SCENES:
+        sdf = scene(scene_name)
+        check_counts(sdf)
+        if isinstance(sdf, Compiled):
+            check_counts(sdf.sdf)
+
+    results = []
+    for stage in args.stage or STAGES:
+        _, sizes = STAGES[stage]
+        if args.size == "small":
+            sizes = sizes[:1]
+        elif args.size == "large":
+            sizes = sizes[-1:]
+        for scene_name in args.scene or SCENES:
+            for size in sizes:
+                result = measure(scene_name, stage, size, args.repeat)
+                print(
+                    f"{scene_name:>8} {stage:>19} {size:>7}"
+                    f"  {result.best:9.4f}s best  {result.median:9.4f}s median",
+                    file=sys.stderr,
+                )
+                results.append(result)
+
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "machine": platform.machine(),
+                "cpus": os.cpu_count(),
+                "results": [asdict(r) for r in results],
+            },
+            f,
+            indent=2,
+        )
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, copy {args.output} there to keep one")
+        return 0
+    with open(args.baseline) as f:
+        baseline = [Result(**r) for r in json.load(f)["results"]]
+    regressions = compare(results, baseline, args.threshold, args.min_delta)
+    print(f"{len(regressions)} of {len(results)} benchmarks regressed")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
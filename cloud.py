@@ -1,47 +1,198 @@
-from random import uniform, seed
+from dataclasses import dataclass
+from random import Random
 from math import dist, hypot
+from typing import Iterator
+
+import numpy as np
 
 from sdf import SDF
 from point import Point, normalize, mul, vec, add, add_mul
-from geo import project_to_surface, SurfacePoint
+from geo import project, project_many, SurfacePoint
+from grid import Grid, pairs_within
+import instrument
+
+
+@dataclass
+class Cloud:
+    """Points on the surface of `sdf`, stored as (N, 3) arrays.
+
+    Indexing and iterating yield `SurfacePoint`s built on demand, for code that
+    works point by point.
+    """
+
+    sdf: SDF
+    positions: np.ndarray
+    normals: np.ndarray
+    directions: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def __getitem__(self, i: int) -> SurfacePoint:
+        return SurfacePoint(
+            point=tuple(self.positions[i].tolist()),
+            direction=tuple(self.directions[i].tolist()),
+            normal=tuple(self.normals[i].tolist()),
+            sdf=self.sdf,
+        )
+
+    def __iter__(self) -> Iterator[SurfacePoint]:
+        return (self[i] for i in range(len(self)))
+
+
+def make_cloud(
+    sdf: SDF, positions: np.ndarray, normals: np.ndarray, direction: Point
+) -> Cloud:
+    """`Cloud` with `direction` made tangent at every point, as in `SurfacePoint`.
+
+    Where the normal is parallel to `direction`, the coordinate axis least
+    aligned with `direction` is made tangent instead. Raises `ValueError` if a
+    normal is zero or not finite, so no NaN reaches the cloud.
+    """
+    d = np.asarray(direction, dtype=float)
+    d /= np.linalg.norm(d)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        normals = normals / np.linalg.norm(normals, axis=1, keepdims=True)
+        directions = d - normals * (normals @ d)[:, None]
+        lengths = np.linalg.norm(directions, axis=1)
+        parallel = lengths < 1e-6
+        if parallel.any():
+            axis = np.eye(3)[np.argmin(np.abs(d))]
+            n = normals[parallel]
+            directions[parallel] = axis - n * (n @ axis)[:, None]
+            lengths[parallel] = np.linalg.norm(directions[parallel], axis=1)
+        directions /= lengths[:, None]
+    if not (np.isfinite(normals).all() and np.isfinite(directions).all()):
+        raise ValueError("Could not make tangent directions, a normal is degenerate")
+    return Cloud(sdf, positions, normals, directions)
 
 
+def as_cloud(points: Cloud | list[SurfacePoint]) -> Cloud:
+    """`points` as a `Cloud`, copying a list of `SurfacePoint`s into arrays."""
+    if isinstance(points, Cloud):
+        return points
+    arrays = [
+        np.array([getattr(p, name) for p in points], dtype=float).reshape(-1, 3)
+        for name in ("point", "normal", "direction")
+    ]
+    return Cloud(points[0].sdf if points else None, *arrays)
+
+
+@instrument.timed("create_cloud")
 def create_cloud(
-    sdf: SDF, num_points: int, near_dist: float, num_steps: int, step_size: float
-) -> list[SurfacePoint]:
+    sdf: SDF,
+    num_points: int,
+    near_dist: float,
+    num_steps: int,
+    step_size: float,
+    *,
+    rng: np.random.Generator | int | None = None,
+    jacobi: bool = False,
+    min_movement: float = 0.0,
+) -> Cloud:
     """Create a point cloud on the surface given by sdf.
 
     Initialize with randomly projected points, then move each point away from other
     points within `near_dist` and reproject them onto the surface. For non-convex
     shapes `near_dist` should be on the order of the size of local convexity.
-    """
-    seed(42)
-
-    def randpoint() -> Point:
-        return mul(normalize((uniform(-2, 2), uniform(-2, 2), uniform(-2, 2))), 5)
+    Neighbours are looked up in a `Grid` with cells of size `near_dist`.
 
-    points = [
-        project_to_surface(sdf, p=randpoint(), direction=(1, 0, 0))
-        for _ in range(num_points)
-    ]
+    The initial points are drawn from `rng`, a generator or a seed; by default
+    they are the same as the original draws from `random.seed(42)`. With `jacobi`,
+    every step moves all points at once from the previous positions, see
+    `_relax_jacobi`. Relaxation stops early once a step moves the points by less
+    than `min_movement` in total.
+    """
+    if rng is None:
+        r = Random(42)
+        initial = [
+            mul(normalize((r.uniform(-2, 2), r.uniform(-2, 2), r.uniform(-2, 2))), 5)
+            for _ in range(num_points)
+        ]
+    else:
+        initial = np.random.default_rng(rng).uniform(-2, 2, (num_points, 3))
+        initial *= 5 / np.linalg.norm(initial, axis=1, keepdims=True)
+    projection = project_many(sdf, initial)
+    if not projection.converged.all():
+        raise ValueError("Could not project point to surface")
+    positions = projection.points
+    normals = projection.normals
+    if jacobi:
+        positions, normals = _relax_jacobi(
+            sdf, positions, normals, near_dist, num_steps, step_size, min_movement
+        )
+        return make_cloud(sdf, positions, normals, direction=(1, 0, 0))
+    points = positions.tolist()
+    grid = Grid(near_dist)
+    for i, p in enumerate(points):
+        grid.insert(i, p)
     for step in range(num_steps):
         total_movement = 0
         for i in range(num_points):
-            pt = points[i]
+            p = points[i]
             move_vec = (0, 0, 0)
-            for j in range(num_points):
+            for j in grid.candidates(p, near_dist):
                 if i == j:
                     continue
-                v = vec(points[j].point, pt.point)
+                v = vec(points[j], p)
                 if hypot(*v) < near_dist:
                     move_vec = add(move_vec, mul(v, 1 / hypot(*v) ** 2))
             if move_vec == (0, 0, 0):
                 continue
-            guess = add_mul(
-                pt.point, move_vec, step_size * (num_steps - step) / num_steps
-            )
-            new_point = project_to_surface(sdf, p=guess, direction=(1, 0, 0))
-            total_movement += dist(pt.point, new_point.point)
+            guess = add_mul(p, move_vec, step_size * (num_steps - step) / num_steps)
+            new_point, normals[i] = project(sdf, guess)
+            total_movement += dist(p, new_point)
             points[i] = new_point
-        print(f"Step {step + 1}/{num_steps} total movement: {total_movement}")
-    return points
+            grid.move(i, new_point)
+        instrument.progress(
+            "create_cloud", step + 1, num_steps, movement=total_movement
+        )
+        if total_movement < min_movement:
+            break
+    return make_cloud(sdf, np.array(points), normals, direction=(1, 0, 0))
+
+
+def _relax_jacobi(
+    sdf: SDF,
+    positions: np.ndarray,
+    normals: np.ndarray,
+    near_dist: float,
+    num_steps: int,
+    step_size: float,
+    min_movement: float,
+) -> tuple[np.ndarray, np.ndarray]:
+    """The repulsion steps of `create_cloud`, each over all points at once.
+
+    The same pushes as the sequential loop, computed for every pair within
+    `near_dist` of the previous step's positions, summed per point and
+    reprojected in one `project_many`. Points whose projection does not converge
+    stay put for the step.
+    """
+    positions = positions.copy()
+    normals = normals.copy()
+    for step in range(num_steps):
+        i, j = pairs_within(positions, near_dist)
+        v = positions[i] - positions[j]
+        push = v / np.einsum("ij,ij->i", v, v)[:, None]
+        move = np.zeros_like(positions)
+        np.add.at(move, i, push)
+        np.add.at(move, j, -push)
+        moving = np.flatnonzero(np.any(move != 0, axis=1))
+        guess = positions[moving] + move[moving] * (
+            step_size * (num_steps - step) / num_steps
+        )
+        projection = project_many(sdf, guess)
+        moved = moving[projection.converged]
+        total_movement = float(
+            np.linalg.norm(
+                projection.points[projection.converged] - positions[moved], axis=1
+            ).sum()
+        )
+        positions[moved] = projection.points[projection.converged]
+        normals[moved] = projection.normals[projection.converged]
+        instrument.progress(
+            "create_cloud", step + 1, num_steps, movement=total_movement
+        )
+        if total_movement < min_movement:
+            break
+    return positions, normals
@@ -0,0 +1,219 @@
+from dataclasses import dataclass, field
+from math import hypot
+from typing import Callable
+
+import numpy as np
+
+from point import Point, transform
+from sdf import (
+    SDF,
+    Bound,
+    Cube,
+    Intersection,
+    Rotated,
+    Shifted,
+    SmoothIntersection,
+    SmoothSubtraction,
+    SmoothUnion,
+    Sphere,
+    Torus,
+    Union,
+    _evaluate,
+    _evaluate_gradient,
+    _value_and_gradient,
+    bound,
+)
+
+Matrix = tuple[Point, Point, Point]
+IDENTITY: Matrix = ((1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0))
+
+# The generated code only calls these names, so the same source runs on floats
+# and, with the NumPy namespace, on whole coordinate columns. `clip` clamps to
+# [0, 1].
+SCALAR_NAMESPACE = {
+    "hypot": hypot,
+    "absolute": abs,
+    "minimum": min,
+    "maximum": max,
+    "clip": lambda x: 0.0 if x < 0.0 else 1.0 if x > 1.0 else x,
+}
+NUMPY_NAMESPACE = {
+    "hypot": np.hypot,
+    "absolute": np.abs,
+    "minimum": np.minimum,
+    "maximum": np.maximum,
+    "clip": lambda x: np.clip(x, 0.0, 1.0),
+}
+
+
+def plus(expr: str, c: float) -> str:
+    if c == 0:
+        return expr
+    if c < 0:
+        return f"{expr} - {-float(c)!r}"
+    return f"{expr} + {float(c)!r}"
+
+
+def matmul(a: Matrix, b: Matrix) -> Matrix:
+    bt = tuple(zip(*b))
+    return tuple(tuple(sum(x * y for x, y in zip(row, col)) for col in bt) for row in a)
+
+
+@dataclass
+class Generator:
+    """Emits one assignment per SDF node into a flat function body."""
+
+    lines: list[str] = field(default_factory=list)
+    opaque: list[SDF] = field(default_factory=list)
+    counter: int = 0
+
+    def var(self, prefix: str) -> str:
+        self.counter += 1
+        return f"{prefix}{self.counter}"
+
+    def emit(self, prefix: str, expr: str) -> str:
+        name = self.var(prefix)
+        self.lines.append(f"    {name} = {expr}")
+        return name
+
+    def node(self, sdf: SDF, x: str, y: str, z: str) -> str:
+        if isinstance(sdf, (Shifted, Rotated)):
+            return self.transformed(sdf, x, y, z)
+        if isinstance(sdf, Sphere):
+            cx, cy, cz = sdf.center
+            return self.emit(
+                "d",
+                plus(
+                    f"hypot(hypot({plus(x, -cx)}, {plus(y, -cy)}), {plus(z, -cz)})",
+                    -sdf.r,
+                ),
+            )
+        if isinstance(sdf, Torus):
+            return self.emit(
+                "d", plus(f"hypot({plus(f'hypot({x}, {z})', -sdf.r1)}, {y})", -sdf.r2)
+            )
+        if isinstance(sdf, Cube):
+            cx, cy, cz = sdf.center
+            return self.emit(
+                "d",
+                plus(
+                    f"maximum(absolute({plus(x, -cx)}), maximum(absolute({plus(y, -cy)}),"
+                    f" absolute({plus(z, -cz)})))",
+                    -sdf.size,
+                ),
+            )
+        if isinstance(sdf, (Union, Intersection)):
+            d1 = self.node(sdf.sdf1, x, y, z)
+            d2 = self.node(sdf.sdf2, x, y, z)
+            op = "minimum" if isinstance(sdf, Union) else "maximum"
+            return self.emit("d", f"{op}({d1}, {d2})")
+        if isinstance(sdf, (SmoothUnion, SmoothIntersection, SmoothSubtraction)):
+            d1 = self.node(sdf.sdf1, x, y, z)
+            d2 = self.node(sdf.sdf2, x, y, z)
+            k = float(sdf.k)
+            if isinstance(sdf, SmoothUnion):
+                h = self.emit("h", f"clip(0.5 + 0.5 * ({d2} - {d1}) / {k!r})")
+                return self.emit(
+                    "d", f"{d2} * (1 - {h}) + {d1} * {h} - {k!r} * {h} * (1.0 - {h})"
+                )
+            if isinstance(sdf, SmoothIntersection):
+                h = self.emit("h", f"clip(0.5 - 0.5 * ({d2} - {d1}) / {k!r})")
+                return self.emit(
+                    "d", f"{d2} * (1 - {h}) + {d1} * {h} + {k!r} * {h} * (1.0 - {h})"
+                )
+            h = self.emit("h", f"clip(0.5 - 0.5 * ({d2} + {d1}) / {k!r})")
+            return self.emit(
+                "d", f"{d2} * (1 - {h}) - {d1} * {h} + {k!r} * {h} * (1.0 - {h})"
+            )
+        self.opaque.append(sdf)
+        return self.emit("d", f"_opaque{len(self.opaque) - 1}({x}, {y}, {z})")
+
+    def transformed(self, sdf: SDF, x: str, y: str, z: str) -> str:
+        # Fold a chain of shifts and rotations into one affine map q = m p + t.
+        m = IDENTITY
+        t = (0.0, 0.0, 0.0)
+        while isinstance(sdf, (Shifted, Rotated)):
+            if isinstance(sdf, Shifted):
+                t = (t[0] + sdf.offset[0], t[1] + sdf.offset[1], t[2] + sdf.offset[2])
+            else:
+                m = matmul(sdf.matrix, m)
+                t = transform(sdf.matrix, t)
+            sdf = sdf.sdf
+        if m == IDENTITY and t == (0.0, 0.0, 0.0):
+            return self.node(sdf, x, y, z)
+        coords = []
+        for axis, row, offset in zip("xyz", m, t):
+            terms = [
+                var if c == 1 else f"{float(c)!r} * {var}"
+                for c, var in zip(row, (x, y, z))
+                if c != 0
+            ]
+            if len(terms) == 1 and offset == 0 and terms[0] in (x, y, z):
+                coords.append(terms[0])
+            else:
+                coords.append(self.emit(axis, plus(" + ".join(terms), offset)))
+        return self.node(sdf, *coords)
+
+
+def generate(sdf: SDF) -> tuple[str, list[SDF]]:
+    """Source of `_sdf(x, y, z)` evaluating `sdf` in one flat function.
+
+    Returns the source and the list of nodes it could not inline; those are
+    called as `_opaque0`, `_opaque1`, ... from the generated code.
+    """
+    gen = Generator()
+    result = gen.node(sdf, "x", "y", "z")
+    body = "\n".join(gen.lines)
+    return f"def _sdf(x, y, z):\n{body}\n    return {result}\n", gen.opaque
+
+
+@dataclass
+class Compiled:
+    """An SDF compiled into flat Python and NumPy functions.
+
+    Evaluation runs the generated code, gradients and bounds are delegated to
+    the original tree. The generated code evaluates every node, it does not
+    cull by bounds. Pickling stores only the original tree and recompiles on load.
+    """
+
+    sdf: SDF
+    source: str = field(init=False, repr=False, compare=False)
+    scalar: Callable = field(init=False, repr=False, compare=False)
+    vectorized: Callable = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        self.source, opaque = generate(self.sdf)
+        code = compile(self.source, "<compiled sdf>", "exec")
+        scalar_ns = dict(SCALAR_NAMESPACE)
+        numpy_ns = dict(NUMPY_NAMESPACE)
+        for i, node in enumerate(opaque):
+            scalar_ns[f"_opaque{i}"] = lambda x, y, z, node=node: node((x, y, z))
+            numpy_ns[f"_opaque{i}"] = lambda x, y, z, node=node: _evaluate(
+                node, np.stack([x, y, z], axis=1)
+            )
+        exec(code, scalar_ns)
+        exec(code, numpy_ns)
+        self.scalar = scalar_ns["_sdf"]
+        self.vectorized = numpy_ns["_sdf"]
+
+    def __reduce__(self):
+        return (Compiled, (self.sdf,))
+
+    def __call__(self, p: Point) -> float:
+        return self.scalar(p[0], p[1], p[2])
+
+    def batch(self, ps: np.ndarray) -> np.ndarray:
+        return self.vectorized(ps[:, 0], ps[:, 1], ps[:, 2])
+
+    def gradient(self, p: Point) -> tuple[float, Point]:
+        return _value_and_gradient(self.sdf, p)
+
+    def batch_gradient(self, ps: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        return _evaluate_gradient(self.sdf, ps)
+
+    def bound(self) -> Bound | None:
+        return bound(self.sdf)
+
+
+def compile_sdf(sdf: SDF) -> SDF:
+    return Compiled(sdf)
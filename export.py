@@ -0,0 +1,255 @@
+import numpy as np
+
+from sdf import SDF
+from geo import Path
+from cloud import Cloud
+from triangulate import Mesh
+
+# Vertex properties written to PLY files, three float32 columns per field.
+PLY_FIELDS = {
+    "positions": ("x", "y", "z"),
+    "normals": ("nx", "ny", "nz"),
+    "directions": ("dx", "dy", "dz"),
+}
+PLY_TYPES = {
+    "char": "i1",
+    "uchar": "u1",
+    "short": "<i2",
+    "ushort": "<u2",
+    "int": "<i4",
+    "uint": "<u4",
+    "float": "<f4",
+    "double": "<f8",
+    "int8": "i1",
+    "uint8": "u1",
+    "int16": "<i2",
+    "uint16": "<u2",
+    "int32": "<i4",
+    "uint32": "<u4",
+    "float32": "<f4",
+    "float64": "<f8",
+}
+STL_DTYPE = np.dtype(
+    [("normal", "<f4", (3,)), ("vertices", "<f4", (3, 3)), ("attribute", "<u2")]
+)
+# Rows formatted per chunk when writing text, bounding the size of the strings.
+CHUNK = 65536
+
+
+def join_paths(paths: list[Path]) -> tuple[Cloud, np.ndarray]:
+    """All path vertices in one `Cloud`, and the (E, 2) edges along each path.
+
+    No paths give an empty cloud without an SDF.
+    """
+    if not paths:
+        empty = np.zeros((0, 3))
+        return Cloud(None, empty, empty, empty), np.zeros((0, 2), dtype=np.int32)
+    cloud = Cloud(
+        paths[0].sdf,
+        np.concatenate([p.points for p in paths]),
+        np.concatenate([p.normals for p in paths]),
+        np.concatenate([p.directions for p in paths]),
+    )
+    ends = np.cumsum([len(p) for p in paths]) - 1
+    first = np.delete(np.arange(len(cloud), dtype=np.int32), ends)
+    return cloud, np.stack([first, first + 1], axis=1)
+
+
+def triangle_normals(positions: np.ndarray, triangles: np.ndarray) -> np.ndarray:
+    """Unit normals of the triangles, by their counter-clockwise winding."""
+    a, b, c = (positions[triangles[:, i]] for i in range(3))
+    n = np.cross(b - a, c - a)
+    norms = np.linalg.norm(n, axis=1, keepdims=True)
+    return np.divide(n, norms, out=np.zeros_like(n), where=norms > 0)
+
+
+def triangle_areas(positions: np.ndarray, triangles: np.ndarray) -> np.ndarray:
+    a, b, c = (positions[triangles[:, i]] for i in range(3))
+    return np.linalg.norm(np.cross(b - a, c - a), axis=1) / 2
+
+
+def write_ply(
+    filename: str,
+    cloud: Cloud,
+    mesh: Mesh | None = None,
+    edges: np.ndarray | None = None,
+) -> None:
+    """Binary little-endian PLY with the cloud's positions, normals, directions.
+
+    Triangles become the `face` element and `edges`, e.g. from `join_paths`,
+    the `edge` element. Each element is written with a single buffer write.
+    """
+    n = len(cloud)
+    vertices = np.empty(n, dtype=[(field, "<f4", (3,)) for field in PLY_FIELDS])
+    for field in PLY_FIELDS:
+        vertices[field] = getattr(cloud, field)
+    header = ["ply", "format binary_little_endian 1.0", f"element vertex {n}"]
+    header += [
+        f"property float {name}" for names in PLY_FIELDS.values() for name in names
+    ]
+    if mesh is not None:
+        header += [
+            f"element face {len(mesh)}",
+            "property list uchar int vertex_indices",
+        ]
+    if edges is not None:
+        header += [
+            f"element edge {len(edges)}",
+            "property int vertex1",
+            "property int vertex2",
+        ]
+    header.append("end_header")
+    with open(filename, "wb") as f:
+        f.write(("\n".join(header) + "\n").encode("ascii"))
+        vertices.tofile(f)
+        if mesh is not None:
+            faces = np.empty(len(mesh), dtype=[("n", "u1"), ("v", "<i4", (3,))])
+            faces["n"] = 3
+            faces["v"] = mesh.triangles
+            faces.tofile(f)
+        if edges is not None:
+            np.ascontiguousarray(edges, dtype="<i4").tofile(f)
+
+
+def load_ply(
+    filename: str, sdf: SDF | None = None
+) -> tuple[Cloud, Mesh | None, np.ndarray | None]:
+    """Memory-map a binary little-endian PLY back into a cloud, mesh and edges.
+
+    Position, normal and direction columns are strided views into the file;
+    missing normals and directions are zero. Faces must all be triangles and
+    are viewed in place too; triangle areas and edge pairs are computed.
+    """
+    with open(filename, "rb") as f:
+        if f.readline().strip() != b"ply":
+            raise ValueError(f"{filename} is not a PLY file")
+        elements: list[tuple[str, int, list[tuple]]] = []
+        while True:
+            line = f.readline()
+            if not line:
+                raise ValueError(f"{filename} has no end_header")
+            words = line.decode("ascii").split()
+            if not words or words[0] in ("comment", "obj_info"):
+                continue
+            if words[0] == "format" and words[1] != "binary_little_endian":
+                raise ValueError("Only binary_little_endian PLY is supported")
+            if words[0] == "element":
+                elements.append((words[1], int(words[2]), []))
+            elif words[0] == "property":
+                if words[1] == "list":
+                    # Read as fixed triangles; checked after loading.
+                    elements[-1][2].append(("n", PLY_TYPES[words[2]]))
+                    elements[-1][2].append(("v", PLY_TYPES[words[3]], (3,)))
+                else:
+                    elements[-1][2].append((words[2], PLY_TYPES[words[1]]))
+            elif words[0] == "end_header":
+                break
+        offset = f.tell()
+    data = {}
+    for name, count, properties in elements:
+        dtype = np.dtype(properties)
+        if count == 0:
+            # np.memmap cannot map zero bytes.
+            data[name] = np.zeros(0, dtype)
+            continue
+        data[name] = np.memmap(filename, dtype, "r", offset, (count,))
+        offset += dtype.itemsize * count
+
+    vertices = data["vertex"]
+    fields = vertices.dtype.fields
+    columns = {}
+    for field, names in PLY_FIELDS.items():
+        if not all(name in fields for name in names):
+            columns[field] = np.zeros((len(vertices), 3), dtype=np.float32)
+            continue
+        types = {fields[name][0] for name in names}
+        starts = [fields[name][1] for name in names]
+        size = fields[names[0]][0].itemsize
+        adjacent = starts == [starts[0] + size * i for i in range(3)]
+        if len(vertices) and len(types) == 1 and adjacent:
+            # Three adjacent columns of one type: view them in place.
+            columns[field] = np.ndarray(
+                (len(vertices), 3),
+                types.pop(),
+                vertices,
+                starts[0],
+                (vertices.dtype.itemsize, size),
+            )
+        else:
+            columns[field] = np.stack([vertices[name] for name in names], axis=1)
+    cloud = Cloud(sdf, columns["positions"], columns["normals"], columns["directions"])
+
+    mesh = None
+    if "face" in data:
+        faces = data["face"]
+        if faces.dtype.names != ("n", "v") or not (faces["n"] == 3).all():
+            raise ValueError("Only triangle faces are supported")
+        triangles = faces["v"]
+        mesh = Mesh(triangles, triangle_areas(cloud.positions, triangles))
+    edges = None
+    if "edge" in data:
+        edge = data["edge"]
+        edges = np.stack([edge["vertex1"], edge["vertex2"]], axis=1)
+    return cloud, mesh, edges
+
+
+def write_stl(filename: str, cloud: Cloud, mesh: Mesh) -> None:
+    """Binary STL of the mesh, with face normals from the winding."""
+    triangles = np.empty(len(mesh), dtype=STL_DTYPE)
+    triangles["normal"] = triangle_normals(cloud.positions, mesh.triangles)
+    triangles["vertices"] = cloud.positions[mesh.triangles]
+    triangles["attribute"] = 0
+    with open(filename, "wb") as f:
+        f.write(b"sdf".ljust(80, b" "))
+        np.array([len(mesh)], dtype="<u4").tofile(f)
+        triangles.tofile(f)
+
+
+def load_stl(filename: str, sdf: SDF | None = None) -> tuple[Cloud, Mesh]:
+    """Binary STL as a cloud with three unshared vertices per triangle.
+
+    The triangles are memory-mapped; STL repeats shared vertices, so the
+    cloud's arrays are copies laid out triangle by triangle.
+    """
+    count = int(np.fromfile(filename, dtype="<u4", count=1, offset=80)[0])
+    triangles = np.memmap(filename, STL_DTYPE, "r", 84, (count,))
+    positions = triangles["vertices"].reshape(-1, 3)
+    normals = np.repeat(triangles["normal"], 3, axis=0)
+    indices = np.arange(3 * count, dtype=np.int32).reshape(-1, 3)
+    cloud = Cloud(sdf, positions, normals, np.zeros_like(normals))
+    return cloud, Mesh(indices, triangle_areas(positions, indices))
+
+
+def write_obj(
+    filename: str,
+    cloud: Cloud,
+    mesh: Mesh | None = None,
+    paths: list[Path] | None = None,
+) -> None:
+    """Wavefront OBJ with vertex normals, faces and one polyline per path.
+
+    Path vertices follow the cloud's. Rows are formatted a chunk at a time
+    with a single string operation per chunk.
+    """
+    with open(filename, "w") as f:
+
+        def rows(template: str, values: np.ndarray) -> None:
+            for i in range(0, len(values), CHUNK):
+                chunk = values[i : i + CHUNK]
+                f.write((template * len(chunk)) % tuple(chunk.ravel().tolist()))
+
+        positions = [cloud.positions]
+        normals = [cloud.normals]
+        if paths:
+            positions += [p.points for p in paths]
+            normals += [p.normals for p in paths]
+        rows("v %.9g %.9g %.9g\n", np.concatenate(positions))
+        rows("vn %.9g %.9g %.9g\n", np.concatenate(normals))
+        if mesh is not None:
+            faces = np.repeat(np.asarray(mesh.triangles, dtype=np.int64) + 1, 2, axis=1)
+            rows("f %d//%d %d//%d %d//%d\n", faces)
+        start = len(cloud) + 1
+        for path in paths or []:
+            indices = np.arange(start, start + len(path))
+            f.write("l " + " ".join(map(str, indices.tolist())) + "\n")
+            start += len(path)
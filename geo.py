@@ -1,8 +1,13 @@
 from dataclasses import dataclass
-from math import dist
+from math import acos, dist
+from typing import Callable
 
-from sdf import Point, SDF, normal
-from point import add_mul, orthogonal, normalize, rotate, vec
+import numpy as np
+
+from sdf import Point, SDF, evaluate_gradient, value_and_gradient
+from point import add_mul, dot, orthogonal, normalize, rotate, vec
+from parallel import pool_map
+import instrument
 
 @dataclass
 class SurfacePoint:
@@ -19,44 +24,255 @@ class SurfacePoint:
         )
 
 
+def project(sdf: SDF, p: Point, eps: float = 1e-6) -> tuple[Point, Point]:
+    """Surface point and normal near `p`, without building a `SurfacePoint`."""
+    for i in range(100):
+        d, grad = value_and_gradient(sdf, p, eps)
+        if abs(d) < eps:
+            instrument.record("project.iterations", i)
+            return p, normalize(grad)
+        # Newton step along the gradient; same as stepping -d along the normal
+        # where the SDF is exact, longer where it underestimates the distance.
+        p = add_mul(p, grad, -d / dot(grad, grad))
+    raise ValueError("Could not project point to surface")
+
+
 def project_to_surface(
     sdf: SDF, *, p: Point, direction: Point, eps: float = 1e-6
 ) -> SurfacePoint:
-    for _ in range(100):
-        d = sdf(p)
-        n = normal(p, sdf, eps)
-        if abs(d) < eps:
-            return SurfacePoint(
-                point=p, direction=orthogonal(direction, n), normal=n, sdf=sdf
+    p, n = project(sdf, p, eps)
+    return SurfacePoint(point=p, direction=orthogonal(direction, n), normal=n, sdf=sdf)
+
+
+@dataclass
+class Projection:
+    points: np.ndarray
+    normals: np.ndarray
+    iterations: np.ndarray
+    converged: np.ndarray
+
+
+def project_many(
+    sdf: SDF,
+    ps: np.ndarray,
+    *,
+    eps: float = 1e-6,
+    max_iterations: int = 100,
+    max_halvings: int = 4,
+) -> Projection:
+    """Batched `project_to_surface` for the rows of `ps`.
+
+    Every iteration takes a Newton step along the gradient for the points that
+    are not yet within `eps` of the surface, reusing the value and gradient
+    evaluated at the end of the previous step. A step that does not reduce
+    |sdf| is halved up to `max_halvings` times. Instead of raising, the result
+    reports the iterations used and whether each point converged.
+    """
+    points = np.array(ps, dtype=float)
+    values, grads = evaluate_gradient(sdf, points, eps)
+    iterations = np.zeros(len(points), dtype=np.int64)
+    active = np.flatnonzero(np.abs(values) >= eps)
+    for _ in range(max_iterations):
+        if not len(active):
+            break
+        iterations[active] += 1
+        g = grads[active]
+        step = g * (values[active] / np.einsum("ij,ij->i", g, g))[:, None]
+        todo = np.arange(len(active))
+        for halving in range(max_halvings + 1):
+            rows = active[todo]
+            q = points[rows] - step[todo]
+            d, g = evaluate_gradient(sdf, q, eps)
+            better = np.abs(d) < np.abs(values[rows])
+            if halving < max_halvings:
+                accept = better
+            else:
+                accept = np.ones(len(todo), dtype=bool)
+            done = rows[accept]
+            points[done], values[done], grads[done] = q[accept], d[accept], g[accept]
+            todo = todo[~accept]
+            step[todo] *= 0.5
+            if not len(todo):
+                break
+        active = active[np.abs(values[active]) >= eps]
+    normals = grads / np.linalg.norm(grads, axis=1, keepdims=True)
+    instrument.record("project.iterations", iterations)
+    return Projection(points, normals, iterations, np.abs(values) < eps)
+
+
+def surface_points(
+    sdf: SDF, projection: Projection, direction: Point
+) -> list[SurfacePoint]:
+    """`SurfacePoint`s of a converged projection, like `project_to_surface`."""
+    if not projection.converged.all():
+        raise ValueError("Could not project point to surface")
+    return [
+        SurfacePoint(
+            point=tuple(p),
+            direction=orthogonal(direction, tuple(n)),
+            normal=tuple(n),
+            sdf=sdf,
+        )
+        for p, n in zip(projection.points.tolist(), projection.normals.tolist())
+    ]
+
+
+@dataclass
+class Path:
+    """A walk on the surface of `sdf` as arrays of its vertices.
+
+    `arc_length` holds the length of the polyline up to each vertex.
+    """
+
+    sdf: SDF
+    points: np.ndarray
+    normals: np.ndarray
+    directions: np.ndarray
+    arc_length: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    @property
+    def length(self) -> float:
+        return float(self.arc_length[-1])
+
+    def surface_points(self) -> list[SurfacePoint]:
+        return [
+            SurfacePoint(
+                point=tuple(p), direction=tuple(d), normal=tuple(n), sdf=self.sdf
             )
-        p = add_mul(p, n, -d)
-    raise ValueError("Could not project point to surface")
+            for p, d, n in zip(
+                self.points.tolist(), self.directions.tolist(), self.normals.tolist()
+            )
+        ]
+
+    def resample(self, spacing: float) -> "Path":
+        """The path with vertices every `spacing`, projected onto the surface."""
+        n = max(2, int(np.ceil(self.length / spacing)) + 1)
+        at = np.linspace(0.0, self.length, n)
+        ps = np.stack(
+            [np.interp(at, self.arc_length, self.points[:, i]) for i in range(3)],
+            axis=1,
+        )
+        return polyline_path(self.sdf, project_many(self.sdf, ps))
+
+
+def polyline_path(sdf: SDF, projection: Projection) -> Path:
+    """`Path` through converged projected points, heading along the polyline."""
+    if not projection.converged.all():
+        raise ValueError("Could not project point to surface")
+    points = projection.points
+    normals = projection.normals
+    segments = np.diff(points, axis=0)
+    arc_length = np.concatenate([[0.0], np.cumsum(np.linalg.norm(segments, axis=1))])
+    directions = (
+        np.gradient(points, axis=0) if len(points) > 1 else np.zeros_like(points)
+    )
+    directions -= normals * np.einsum("ij,ij->i", directions, normals)[:, None]
+    norms = np.linalg.norm(directions, axis=1, keepdims=True)
+    directions = np.divide(
+        directions, norms, out=np.zeros_like(directions), where=norms > 0
+    )
+    return Path(sdf, points, normals, directions, arc_length)
+
+
+def walk(
+    start: SurfacePoint,
+    distance: float | None = None,
+    *,
+    target: Point | None = None,
+    min_step: float = 1e-3,
+    max_step: float = 0.1,
+    max_turn: float = 0.05,
+    eps: float = 1e-6,
+) -> Path:
+    """Walk from `start` along its direction, keeping it tangent to the surface.
+
+    The walk stops after `distance`, or where it gets closest to `target`.
+    Steps double while the normal turns by less than a quarter of `max_turn`
+    radians per step and halve, down to `min_step`, when it turns by more, so
+    flat stretches take few long steps. Near `target` the last step is halved
+    until the closest approach is located to within `min_step`.
+    """
+    if distance is None and target is None:
+        raise ValueError("Pass a distance or a target")
+    sdf = start.sdf
+    p, n, d = start.point, start.normal, start.direction
+    points, normals, directions, arc_length = [p], [n], [d], [0.0]
+    traveled = 0.0
+    h = min_step
+    while True:
+        if distance is not None:
+            if distance - traveled <= 1e-12:
+                break
+            h = min(h, distance - traveled)
+        q, m = project(sdf, add_mul(p, d, h), eps)
+        turn = acos(max(-1.0, min(1.0, dot(n, m))))
+        if turn > max_turn and h > min_step:
+            h = max(h / 2, min_step)
+            continue
+        e = orthogonal(d, m)
+        # Past the closest approach the direction points away from the target.
+        overshot = target is not None and dot(e, vec(q, target)) < 0
+        if overshot and h > min_step:
+            h = max(h / 2, min_step)
+            continue
+        if overshot and dist(q, target) >= dist(p, target):
+            break
+        traveled += h
+        p, n, d = q, m, e
+        points.append(p)
+        normals.append(n)
+        directions.append(d)
+        arc_length.append(traveled)
+        if overshot:
+            break
+        if turn < max_turn / 4:
+            h = min(2 * h, max_step)
+    return Path(
+        sdf,
+        np.array(points),
+        np.array(normals),
+        np.array(directions),
+        np.array(arc_length),
+    )
 
 
 @dataclass
 class Approach:
     error: float
     distance_traveled: float
+    path: Path
 
 
 def closest_approach(
-    start: SurfacePoint, target: SurfacePoint, step_size: float
+    start: SurfacePoint,
+    target: SurfacePoint,
+    step_size: float,
+    *,
+    max_step: float = 0.1,
+    max_turn: float = 0.05,
 ) -> Approach:
-    prev = dist(start.point, target.point)
-    distance_traveled = 0
-    while True:
-        start = start.move(step_size)
-        distance_traveled += step_size
-        curr = dist(start.point, target.point)
-        if curr > prev:
-            return Approach(prev, distance_traveled)
-        prev = curr
+    path = walk(
+        start,
+        target=target.point,
+        min_step=step_size,
+        max_step=max(step_size, max_step),
+        max_turn=max_turn,
+    )
+    error = dist(tuple(path.points[-1]), target.point)
+    return Approach(error, path.length, path)
 
 @dataclass
 class Connection:
-    points: list[SurfacePoint]
+    path: Path
     distance: float
 
+    @property
+    def points(self) -> list[SurfacePoint]:
+        return self.path.surface_points()
+
 def connect(
     sdf: SDF, p: Point, q: Point, *, step_size: float = 1e-3, eps: float = 1e-4
 ) -> Connection:
@@ -89,7 +305,7 @@ def connect(
         -initial_d_ang if left_approach.error < right_approach.error else initial_d_ang
     )
     while abs(d_ang) > eps:
-        # print(f"{ang=}, {d_ang=}, {approach=}")
+        instrument.count("connect.approaches")
         curr_ang = ang + d_ang
         curr_approach = closest_approach(
             SurfacePoint(
@@ -101,7 +317,6 @@ def connect(
             end,
             step_size=step_size,
         )
-        # print(f"{curr_ang=}, {curr_approach=}")
         if curr_approach.error < approach.error:
             approach = curr_approach
             ang = curr_ang
@@ -118,16 +333,42 @@ def connect(
             step_size=step_size,
         )
         d_ang *= 0.5
-    final_start = SurfacePoint(
-        point=start.point,
-        normal=start.normal,
-        direction=rotate(start.direction, start.normal, ang),
-        sdf=sdf,
+    instrument.record("connect.error", approach.error)
+    return Connection(approach.path, approach.path.length)
+
+
+def _connect(task: tuple[SDF, Point, Point, float, float]) -> Connection:
+    sdf, p, q, step_size, eps = task
+    return connect(sdf, p, q, step_size=step_size, eps=eps)
+
+
+@instrument.timed("connect")
+def connect_many(
+    sdf: SDF,
+    pairs: list[tuple[Point, Point]],
+    *,
+    step_size: float = 1e-3,
+    eps: float = 1e-4,
+    processes: int | None = None,
+    progress: Callable[[int, int], None] | None = None,
+) -> list[Connection]:
+    """`connect` for every pair, spread over `processes` worker processes.
+
+    Connections are returned in the order of `pairs`; `progress(done, total)` is
+    called after each one finishes.
+    """
+    done = 0
+
+    def on_result(i: int, connection: Connection) -> None:
+        nonlocal done
+        done += 1
+        instrument.progress("connect", done, len(pairs))
+        if progress is not None:
+            progress(done, len(pairs))
+
+    return pool_map(
+        _connect,
+        [(sdf, p, q, step_size, eps) for p, q in pairs],
+        processes=processes,
+        on_result=on_result,
     )
-    path = [final_start]
-    distance_traveled = 0.0
-    while distance_traveled < approach.distance_traveled:
-        final_start = final_start.move(step_size)
-        path.append(final_start)
-        distance_traveled += step_size
-    return Connection(path, distance_traveled)
@@ -0,0 +1,196 @@
+from dataclasses import dataclass, field
+from math import ceil, inf
+from typing import Callable
+import heapq
+
+import numpy as np
+
+from sdf import SDF
+from point import Point
+from geo import Connection, SurfacePoint, polyline_path, project_many
+from grid import Grid
+from parallel import pool_map
+import instrument
+from cloud import Cloud, as_cloud
+from triangulate import Mesh, Triangle, as_mesh
+
+
+def resample(path: np.ndarray, spacing: float) -> np.ndarray:
+    """Points at (nearly) equal arc length `spacing` along a polyline."""
+    seg = np.linalg.norm(np.diff(path, axis=0), axis=1)
+    arc = np.concatenate([[0.0], np.cumsum(seg)])
+    n = max(2, ceil(arc[-1] / spacing) + 1)
+    at = np.linspace(0.0, arc[-1], n)
+    return np.stack([np.interp(at, arc, path[:, i]) for i in range(3)], axis=1)
+
+
+def shorten(
+    sdf: SDF, path: np.ndarray, *, spacing: float, iterations: int
+) -> np.ndarray:
+    """Pull a surface polyline with fixed ends taut along the surface.
+
+    Interior points repeatedly move to the midpoint of their neighbours and
+    are projected back, which converges to a geodesic. This is done coarse to
+    fine, halving the spacing down to `spacing`, so each level starts close to
+    its solution. Points whose projection does not converge keep their previous
+    position.
+    """
+    length = np.linalg.norm(np.diff(path, axis=0), axis=1).sum()
+    level = spacing
+    while level * 8 < length:
+        level *= 2
+    while True:
+        path = resample(path, level)
+        if len(path) > 2:
+            path[1:-1] = _project_or_keep(sdf, path[1:-1], path[1:-1])
+            for _ in range(iterations):
+                midpoints = (path[:-2] + path[2:]) / 2
+                path[1:-1] = _project_or_keep(sdf, midpoints, path[1:-1])
+        if level <= spacing:
+            return path
+        level /= 2
+
+
+def _project_or_keep(sdf: SDF, ps: np.ndarray, previous: np.ndarray) -> np.ndarray:
+    """`ps` projected onto the surface, `previous` where that did not converge."""
+    projection = project_many(sdf, ps)
+    return np.where(projection.converged[:, None], projection.points, previous)
+
+
+@dataclass
+class MeshGeodesics:
+    """Geodesics on the surface of `sdf`, seeded by shortest paths in a mesh.
+
+    Distances along mesh edges from one source vertex to many targets come from
+    a single Dijkstra search; the resulting edge paths are then shortened on
+    the SDF itself.
+    """
+
+    sdf: SDF
+    vertices: Cloud | list[SurfacePoint]
+    triangles: Mesh | list[Triangle]
+    neighbours: list[dict[int, float]] = field(init=False, repr=False)
+    grid: Grid = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self.vertices = as_cloud(self.vertices)
+        self.triangles = as_mesh(self.triangles)
+        positions = self.vertices.positions
+        edges = self.triangles.edges()
+        lengths = np.linalg.norm(
+            positions[edges[:, 0]] - positions[edges[:, 1]], axis=1
+        )
+        self.neighbours = [{} for _ in range(len(positions))]
+        for (a, b), d in zip(edges.tolist(), lengths.tolist()):
+            self.neighbours[a][b] = d
+            self.neighbours[b][a] = d
+        self.grid = Grid(float(lengths.mean()) if len(lengths) else 1.0)
+        for i, p in enumerate(positions.tolist()):
+            self.grid.insert(i, p)
+
+    def shortest_paths(
+        self, source: int, targets: set[int] | None = None
+    ) -> dict[int, int]:
+        """Dijkstra parents from `source`, stopping once all `targets` settle."""
+        remaining = set(targets) if targets is not None else None
+        distance = {source: 0.0}
+        parent = {source: source}
+        settled = set()
+        heap = [(0.0, source)]
+        while heap:
+            d, v = heapq.heappop(heap)
+            if v in settled:
+                continue
+            settled.add(v)
+            if remaining is not None:
+                remaining.discard(v)
+                if not remaining:
+                    break
+            for w, length in self.neighbours[v].items():
+                nd = d + length
+                if nd < distance.get(w, inf):
+                    distance[w] = nd
+                    parent[w] = v
+                    heapq.heappush(heap, (nd, w))
+        return parent
+
+    def connect_from(
+        self,
+        p: Point,
+        qs: list[Point],
+        *,
+        spacing: float = 0.05,
+        iterations: int = 30,
+    ) -> list[Connection]:
+        """Geodesics from `p` to each of `qs`, sharing one mesh search.
+
+        Paths are shortened and returned with vertices every `spacing`.
+        """
+        source = self.grid.nearest(p)
+        ends = [self.grid.nearest(q) for q in qs]
+        parent = self.shortest_paths(source, set(ends))
+        connections = []
+        for q, end in zip(qs, ends):
+            if end not in parent:
+                raise ValueError("Target is not connected to the source in the mesh")
+            chain = [end]
+            while chain[-1] != source:
+                chain.append(parent[chain[-1]])
+            seed = np.concatenate(
+                [[q], self.vertices.positions[chain], [p]], dtype=float
+            )[::-1]
+            path = shorten(self.sdf, seed, spacing=spacing, iterations=iterations)
+            path = polyline_path(self.sdf, project_many(self.sdf, path))
+            connections.append(Connection(path, path.length))
+        return connections
+
+    @instrument.timed("geodesics")
+    def connect_many(
+        self,
+        pairs: list[tuple[Point, Point]],
+        *,
+        spacing: float = 0.05,
+        iterations: int = 30,
+        processes: int | None = None,
+        progress: Callable[[int, int], None] | None = None,
+    ) -> list[Connection]:
+        """`connect_from` for every pair, spread over `processes` processes.
+
+        Pairs with the same first point share one task and one mesh search.
+        Connections are returned in the order of `pairs`, and
+        `progress(done, total)` is called as each task's connections finish.
+        """
+        sources: dict[Point, list[int]] = {}
+        for i, (p, _) in enumerate(pairs):
+            sources.setdefault(p, []).append(i)
+        groups = list(sources.items())
+        done = 0
+
+        def on_result(i: int, connections: list[Connection]) -> None:
+            nonlocal done
+            done += len(connections)
+            instrument.progress("geodesics", done, len(pairs))
+            if progress is not None:
+                progress(done, len(pairs))
+
+        results = pool_map(
+            _connect_from,
+            [
+                (self, p, [pairs[i][1] for i in idxs], spacing, iterations)
+                for p, idxs in groups
+            ],
+            processes=processes,
+            on_result=on_result,
+        )
+        connections: list[Connection] = [None] * len(pairs)
+        for (_, idxs), group in zip(groups, results):
+            for i, connection in zip(idxs, group):
+                connections[i] = connection
+        return connections
+
+
+def _connect_from(
+    task: tuple[MeshGeodesics, Point, list[Point], float, int],
+) -> list[Connection]:
+    geodesics, p, qs, spacing, iterations = task
+    return geodesics.connect_from(p, qs, spacing=spacing, iterations=iterations)
@@ -0,0 +1,175 @@
+from dataclasses import dataclass, field
+from itertools import product
+from math import ceil, dist, floor, inf
+
+import numpy as np
+
+from point import Point
+
+Cell = tuple[int, int, int]
+# The cell itself and half of its 26 neighbours, one of each opposite pair, so
+# every pair of neighbouring cells is visited once.
+HALF_NEIGHBOURS = [o for o in product((-1, 0, 1), repeat=3) if o >= (0, 0, 0)]
+
+
+@dataclass
+class Grid:
+    """Uniform hash grid of indexed points for fixed-radius neighbour queries.
+
+    Choose `cell_size` close to the query radius; points can be moved
+    individually and only change bucket when they cross a cell boundary.
+    """
+
+    cell_size: float
+    cells: dict[Cell, set[int]] = field(default_factory=dict)
+    positions: dict[int, Point] = field(default_factory=dict)
+
+    def cell(self, p: Point) -> Cell:
+        return (
+            floor(p[0] / self.cell_size),
+            floor(p[1] / self.cell_size),
+            floor(p[2] / self.cell_size),
+        )
+
+    def insert(self, idx: int, p: Point) -> None:
+        self.positions[idx] = p
+        self.cells.setdefault(self.cell(p), set()).add(idx)
+
+    def remove(self, idx: int) -> None:
+        key = self.cell(self.positions.pop(idx))
+        bucket = self.cells[key]
+        bucket.discard(idx)
+        if not bucket:
+            del self.cells[key]
+
+    def move(self, idx: int, p: Point) -> None:
+        if self.cell(self.positions[idx]) == self.cell(p):
+            self.positions[idx] = p
+            return
+        self.remove(idx)
+        self.insert(idx, p)
+
+    def candidates(self, p: Point, radius: float) -> list[int]:
+        """Sorted indices of all points in cells overlapping the `radius` box.
+
+        This is a superset of the points within `radius`; callers that need the
+        exact set filter it themselves or use `near`.
+        """
+        cx, cy, cz = self.cell(p)
+        r = ceil(radius / self.cell_size)
+        found = []
+        for x in range(cx - r, cx + r + 1):
+            for y in range(cy - r, cy + r + 1):
+                for z in range(cz - r, cz + r + 1):
+                    bucket = self.cells.get((x, y, z))
+                    if bucket:
+                        found.extend(bucket)
+        found.sort()
+        return found
+
+    def near(self, p: Point, radius: float) -> list[int]:
+        return [
+            i for i in self.candidates(p, radius) if dist(p, self.positions[i]) < radius
+        ]
+
+    def nearest(self, p: Point) -> int | None:
+        """Index of the point closest to `p`, the lowest index on ties."""
+        cx, cy, cz = self.cell(p)
+        best = None
+        best_dist = inf
+        r = 0
+        while (2 * r + 1) ** 3 <= len(self.cells):
+            for x in range(cx - r, cx + r + 1):
+                for y in range(cy - r, cy + r + 1):
+                    for z in range(cz - r, cz + r + 1):
+                        if max(abs(x - cx), abs(y - cy), abs(z - cz)) != r:
+                            continue
+                        for i in self.cells.get((x, y, z), ()):
+                            d = dist(p, self.positions[i])
+                            if d < best_dist or (d == best_dist and i < best):
+                                best = i
+                                best_dist = d
+            # Everything outside the cube of shells 0..r is at least this far.
+            if best_dist <= r * self.cell_size:
+                return best
+            r += 1
+        # The shells got larger than the occupied part of the grid.
+        for i, q in self.positions.items():
+            d = dist(p, q)
+            if d < best_dist or (d == best_dist and i < best):
+                best = i
+                best_dist = d
+        return best
+
+
+def pairs_within(positions: np.ndarray, radius: float) -> tuple[np.ndarray, np.ndarray]:
+    """Index arrays `i < j` of all pairs of rows of `positions` closer than `radius`.
+
+    The vectorized counterpart of querying a `Grid` for every point: points are
+    sorted by cell of size `radius`, and each cell is matched against itself
+    and half of its neighbours with binary searches on the sorted cell keys.
+    """
+    positions = np.asarray(positions, dtype=float)
+    i, j = _close_pairs(positions, positions, radius, HALF_NEIGHBOURS, distinct=True)
+    swap = i > j
+    i[swap], j[swap] = j[swap], i[swap]
+    return i, j
+
+
+def pairs_between(
+    a: np.ndarray, b: np.ndarray, radius: float
+) -> tuple[np.ndarray, np.ndarray]:
+    """Index arrays `i` into `a` and `j` into `b` of the pairs closer than `radius`."""
+    a = np.asarray(a, dtype=float).reshape(-1, 3)
+    b = np.asarray(b, dtype=float).reshape(-1, 3)
+    return _close_pairs(a, b, radius, list(product((-1, 0, 1), repeat=3)))
+
+
+def _close_pairs(
+    queries: np.ndarray,
+    targets: np.ndarray,
+    radius: float,
+    neighbours: list[Cell],
+    distinct: bool = False,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Pairs of a query and a target closer than `radius` in the given cells.
+
+    Targets are sorted by the key of their cell, and every query looks up the
+    targets in each of the `neighbours` cell offsets from its own. With
+    `distinct`, queries and targets are the same points and only pairs with
+    `i < j` are kept within a cell.
+    """
+    if not len(queries) or not len(targets):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    query_cells = np.floor(queries / radius).astype(np.int64)
+    target_cells = np.floor(targets / radius).astype(np.int64)
+    lo = np.minimum(query_cells.min(axis=0), target_cells.min(axis=0)) - 1
+    dims = np.maximum(query_cells.max(axis=0), target_cells.max(axis=0)) - lo + 2
+
+    def keys(cells: np.ndarray) -> np.ndarray:
+        cells = cells - lo
+        return (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+
+    query_keys = keys(query_cells)
+    target_keys = keys(target_cells)
+    order = np.argsort(target_keys, kind="stable")
+    sorted_keys = target_keys[order]
+    found_i = []
+    found_j = []
+    for dx, dy, dz in neighbours:
+        neighbour = query_keys + (dx * dims[1] + dy) * dims[2] + dz
+        start = np.searchsorted(sorted_keys, neighbour, side="left")
+        counts = np.searchsorted(sorted_keys, neighbour, side="right") - start
+        i = np.repeat(np.arange(len(queries)), counts)
+        offsets = np.arange(len(i)) - np.repeat(np.cumsum(counts) - counts, counts)
+        j = order[np.repeat(start, counts) + offsets]
+        if distinct and (dx, dy, dz) == (0, 0, 0):
+            keep = i < j
+            i, j = i[keep], j[keep]
+        found_i.append(i)
+        found_j.append(j)
+    i = np.concatenate(found_i)
+    j = np.concatenate(found_j)
+    v = queries[i] - targets[j]
+    close = np.einsum("ij,ij->i", v, v) < radius * radius
+    return i[close], j[close]
@@ -0,0 +1,192 @@
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import wraps
+from math import inf
+from time import perf_counter
+from typing import Any, Callable, Iterator, TypeVar
+
+import numpy as np
+
+
+@dataclass
+class Event:
+    """One measurement: a finished stage, a count, a recorded value or progress.
+
+    `value` is seconds for "stage", the increment for "count", the sample(s)
+    for "record" and the number of finished steps for "progress", out of
+    `total`.
+    """
+
+    kind: str
+    name: str
+    value: Any
+    total: int | None = None
+    details: dict[str, Any] = field(default_factory=dict)
+
+
+Sink = Callable[[Event], None]
+F = TypeVar("F", bound=Callable[..., Any])
+
+# Installed sinks. Every function below returns right away while this is
+# empty, so instrumented code costs one call and a list check when unobserved.
+_sinks: list[Sink] = []
+# Counts since the last `flush`. Counters are bumped in hot loops, so they are
+# summed here and reach the sinks as one event per name.
+_counts: dict[str, int] = {}
+
+
+def add_sink(sink: Sink) -> None:
+    _sinks.append(sink)
+
+
+def remove_sink(sink: Sink) -> None:
+    flush()
+    _sinks.remove(sink)
+
+
+def clear_sinks() -> None:
+    """Remove every sink, e.g. in a worker process that inherited them."""
+    _sinks.clear()
+    _counts.clear()
+
+
+@contextmanager
+def recording(*sinks: Sink) -> Iterator[None]:
+    """Install `sinks` for the duration of the block."""
+    for sink in sinks:
+        add_sink(sink)
+    try:
+        yield
+    finally:
+        for sink in sinks:
+            remove_sink(sink)
+
+
+def enabled() -> bool:
+    """Whether any sink listens; check it before computing costly details."""
+    return bool(_sinks)
+
+
+def emit(event: Event) -> None:
+    for sink in _sinks:
+        sink(event)
+
+
+def count(name: str, n: int = 1) -> None:
+    if _sinks:
+        _counts[name] = _counts.get(name, 0) + n
+
+
+def flush() -> None:
+    """Send the counts summed so far; done at the end of every stage."""
+    counts = list(_counts.items())
+    _counts.clear()
+    for name, n in counts:
+        emit(Event("count", name, n))
+
+
+def record(name: str, value: float | np.ndarray) -> None:
+    """A sample, or an array of samples, of a quantity such as steps per ray."""
+    if _sinks:
+        emit(Event("record", name, value))
+
+
+def progress(name: str, done: int, total: int | None, **details: Any) -> None:
+    """`done` steps out of `total`, or of an unknown number if it is None."""
+    if _sinks:
+        emit(Event("progress", name, done, total, details))
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Report the wall time of the block as stage `name`."""
+    if not _sinks:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        flush()
+        emit(Event("stage", name, perf_counter() - start))
+
+
+def timed(name: str) -> Callable[[F], F]:
+    """Decorator reporting every call of the function as stage `name`."""
+
+    def decorator(function: F) -> F:
+        @wraps(function)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with stage(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def print_sink(event: Event) -> None:
+    """Print progress and stage times, like the pipeline's old progress lines."""
+    if event.kind == "progress":
+        details = "".join(f", {k} {v}" for k, v in event.details.items())
+        total = "" if event.total is None else f"/{event.total}"
+        print(f"{event.name} {event.value}{total}{details}")
+    elif event.kind == "stage":
+        print(f"{event.name} took {event.value:.3f}s")
+
+
+@dataclass
+class Stat:
+    count: int = 0
+    total: float = 0.0
+    min: float = inf
+    max: float = -inf
+
+    def add(self, value: float | np.ndarray) -> None:
+        if isinstance(value, (int, float)):
+            self.count += 1
+            self.total += value
+            self.min = min(self.min, value)
+            self.max = max(self.max, value)
+            return
+        values = np.asarray(value, dtype=float)
+        if not values.size:
+            return
+        self.count += values.size
+        self.total += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+@dataclass
+class Metrics:
+    """A sink aggregating stage times, counters and recorded values by name."""
+
+    stages: dict[str, Stat] = field(default_factory=dict)
+    counters: dict[str, int] = field(default_factory=dict)
+    values: dict[str, Stat] = field(default_factory=dict)
+
+    def __call__(self, event: Event) -> None:
+        if event.kind == "stage":
+            self.stages.setdefault(event.name, Stat()).add(event.value)
+        elif event.kind == "count":
+            self.counters[event.name] = self.counters.get(event.name, 0) + event.value
+        elif event.kind == "record":
+            self.values.setdefault(event.name, Stat()).add(event.value)
+
+    def report(self) -> str:
+        lines = []
+        for name, s in sorted(self.stages.items()):
+            lines.append(f"{name:<28} {s.total:10.3f}s in {s.count} calls")
+        for name, n in sorted(self.counters.items()):
+            lines.append(f"{name:<28} {n:>10}")
+        for name, s in sorted(self.values.items()):
+            lines.append(
+                f"{name:<28} mean {s.mean:10.3f}  min {s.min:g}  max {s.max:g}"
+                f"  ({s.count} samples)"
+            )
+        return "\n".join(lines)
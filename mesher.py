@@ -0,0 +1,137 @@
+from math import ceil
+
+import numpy as np
+
+from point import Point
+from sdf import SDF, bound, evaluate, evaluate_gradient
+from geo import project_many
+from cloud import Cloud, make_cloud
+from triangulate import Mesh
+import instrument
+
+# For edges along each axis: the two other axes, in the order whose cross
+# product is the edge axis, so quads wind counter-clockwise around it.
+AXES = ((0, 1, 2), (1, 2, 0), (2, 0, 1))
+
+
+@instrument.timed("dual_contour")
+def dual_contour(
+    sdf: SDF,
+    cell_size: float,
+    *,
+    lo: Point | None = None,
+    hi: Point | None = None,
+    regularization: float = 0.05,
+    project: bool = False,
+) -> tuple[Cloud, Mesh]:
+    """Mesh the zero level set of `sdf` by dual contouring on a regular grid.
+
+    The SDF is sampled at the grid nodes in one batch. Every cell with a sign
+    change gets one vertex minimizing the squared distances to the tangent
+    planes at its edge crossings, pulled towards their mean by
+    `regularization` and clamped to the cell. Every edge with a sign change
+    becomes a quad of the vertices of the four cells around it, split into two
+    triangles wound counter-clockwise seen from outside. The surface must stay
+    inside the box, which defaults to the bounding sphere of `sdf` grown by one
+    cell; the mesh is then closed. With `project`, vertices are moved onto the
+    surface with `project_many`.
+    """
+    if lo is None or hi is None:
+        b = bound(sdf)
+        if b is None:
+            raise ValueError("SDF has no bound, pass lo and hi")
+        r = b.radius + cell_size
+        lo = tuple(c - r for c in b.center)
+        hi = tuple(c + r for c in b.center)
+    h = cell_size
+    origin = np.asarray(lo, dtype=float)
+    shape = tuple(max(1, ceil((top - bottom) / h)) for bottom, top in zip(lo, hi))
+    axes = [origin[i] + h * np.arange(shape[i] + 1) for i in range(3)]
+    nodes = np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1)
+    values = evaluate(sdf, nodes.reshape(-1, 3)).reshape(nodes.shape[:3])
+    inside = values < 0
+
+    # Crossings on the edges along each axis, as the index of the lower node.
+    crossings = []
+    for axis in range(3):
+        lower = [slice(None)] * 3
+        upper = [slice(None)] * 3
+        lower[axis] = slice(None, -1)
+        upper[axis] = slice(1, None)
+        idx = np.argwhere(inside[tuple(lower)] != inside[tuple(upper)])
+        step = np.zeros(3, dtype=np.int64)
+        step[axis] = 1
+        v0 = values[tuple(idx.T)]
+        v1 = values[tuple((idx + step).T)]
+        t = v0 / (v0 - v1)
+        points = origin + (idx + t[:, None] * step) * h
+        crossings.append((idx, step, points, v0 < 0))
+
+    # Accumulate each crossing's tangent plane into the (up to) four cells
+    # sharing its edge.
+    num_cells = int(np.prod(shape))
+    ata = np.zeros((num_cells, 3, 3))
+    atb = np.zeros((num_cells, 3))
+    mass = np.zeros((num_cells, 3))
+    count = np.zeros(num_cells)
+    cell_shape = np.array(shape)
+    for axis, (idx, step, points, _) in enumerate(crossings):
+        _, normals = evaluate_gradient(sdf, points)
+        normals /= np.linalg.norm(normals, axis=1, keepdims=True)
+        _, u, v = AXES[axis]
+        for du in (-1, 0):
+            for dv in (-1, 0):
+                cells = idx.copy()
+                cells[:, u] += du
+                cells[:, v] += dv
+                ok = np.all((cells >= 0) & (cells < cell_shape), axis=1)
+                flat = np.ravel_multi_index(tuple(cells[ok].T), shape)
+                n = normals[ok]
+                np.add.at(ata, flat, n[:, :, None] * n[:, None, :])
+                np.add.at(atb, flat, n * np.einsum("ij,ij->i", n, points[ok])[:, None])
+                np.add.at(mass, flat, points[ok])
+                np.add.at(count, flat, 1)
+
+    active = np.flatnonzero(count)
+    mean = mass[active] / count[active, None]
+    # Solve for the offset from the mean, so the regularization pulls towards it.
+    lhs = ata[active] + regularization * np.eye(3)
+    rhs = atb[active] - np.einsum("ijk,ik->ij", ata[active], mean)
+    positions = mean + np.linalg.solve(lhs, rhs[:, :, None])[:, :, 0]
+    cell_lo = origin + np.array(np.unravel_index(active, shape)).T * h
+    positions = np.clip(positions, cell_lo, cell_lo + h)
+    vertex = np.full(num_cells, -1, dtype=np.int64)
+    vertex[active] = np.arange(len(active))
+
+    quads = []
+    for axis, (idx, _, _, outward) in enumerate(crossings):
+        _, u, v = AXES[axis]
+        corners = []
+        for du, dv in ((-1, -1), (0, -1), (0, 0), (-1, 0)):
+            cells = idx.copy()
+            cells[:, u] += du
+            cells[:, v] += dv
+            corners.append(cells)
+        ok = np.all(
+            [np.all((c >= 0) & (c < cell_shape), axis=1) for c in corners], axis=0
+        )
+        quad = np.stack(
+            [vertex[np.ravel_multi_index(tuple(c[ok].T), shape)] for c in corners],
+            axis=1,
+        )
+        # Reverse the quads whose inside is on the upper node.
+        quad[~outward[ok]] = quad[~outward[ok], ::-1]
+        quads.append(quad)
+    quads = np.concatenate(quads)
+    triangles = np.concatenate([quads[:, [0, 1, 2]], quads[:, [0, 2, 3]]])
+
+    if project:
+        projection = project_many(sdf, positions)
+        positions = np.where(
+            projection.converged[:, None], projection.points, positions
+        )
+    _, normals = evaluate_gradient(sdf, positions)
+    a, b, c = (positions[triangles[:, i]] for i in range(3))
+    areas = np.linalg.norm(np.cross(b - a, c - a), axis=1) / 2
+    cloud = make_cloud(sdf, positions, normals, direction=(1, 0, 0))
+    return cloud, Mesh(triangles.astype(np.int32), areas)
@@ -0,0 +1,58 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from threading import Event
+from typing import Any, Callable, Iterable
+import os
+
+import instrument
+
+
+def pool_map(
+    function: Callable[[Any], Any],
+    tasks: Iterable[Any],
+    *,
+    processes: int | None = None,
+    on_result: Callable[[int, Any], None] | None = None,
+    cancel: Event | None = None,
+) -> list[Any]:
+    """`[function(task) for task in tasks]`, computed on a process pool.
+
+    `function` and the tasks must pickle, so use module-level functions and
+    dataclass or compiled SDFs rather than closures. Results come back in task
+    order; `on_result(index, result)` is called in this process as each task
+    finishes. `processes` defaults to one per core, and with a single process
+    everything runs here without a pool.
+
+    Worker processes start without instrumentation sinks, so only events of
+    this process are reported.
+
+    Setting `cancel` stops the map early: queued tasks are dropped, running
+    ones finish and are delivered, and the results of dropped tasks are None.
+    """
+    tasks = list(tasks)
+    results: list[Any] = [None] * len(tasks)
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes == 1:
+        for i, task in enumerate(tasks):
+            if cancel is not None and cancel.is_set():
+                break
+            results[i] = function(task)
+            if on_result is not None:
+                on_result(i, results[i])
+        return results
+    with ProcessPoolExecutor(processes, initializer=instrument.clear_sinks) as pool:
+        futures = {pool.submit(function, task): i for i, task in enumerate(tasks)}
+        pending = set(futures)
+        while pending:
+            if cancel is not None and cancel.is_set():
+                # Drop the queued tasks; the running ones finish and are
+                # delivered like the others.
+                pool.shutdown(wait=False, cancel_futures=True)
+                pending = {future for future in pending if not future.cancelled()}
+            done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = futures[future]
+                results[i] = future.result()
+                if on_result is not None:
+                    on_result(i, results[i])
+    return results
@@ -26,6 +26,42 @@ def orthogonal(v: Point, n: Point) -> Point:
     return normalize((v[0] - d * n[0], v[1] - d * n[1], v[2] - d * n[2]))
 
 
+def rotation_matrix(axis: Point, angle: float) -> tuple[Point, Point, Point]:
+    """Rows of the matrix applied by `rotate(p, axis, angle)`."""
+    ux, uy, uz = axis
+    cos_a = cos(angle)
+    sin_a = sin(angle)
+    return (
+        (
+            cos_a + (1 - cos_a) * ux * ux,
+            (1 - cos_a) * ux * uy - uz * sin_a,
+            (1 - cos_a) * ux * uz + uy * sin_a,
+        ),
+        (
+            (1 - cos_a) * uy * ux + uz * sin_a,
+            cos_a + (1 - cos_a) * uy * uy,
+            (1 - cos_a) * uy * uz - ux * sin_a,
+        ),
+        (
+            (1 - cos_a) * uz * ux - uy * sin_a,
+            (1 - cos_a) * uz * uy + ux * sin_a,
+            cos_a + (1 - cos_a) * uz * uz,
+        ),
+    )
+
+
+def transform(m: tuple[Point, Point, Point], p: Point) -> Point:
+    return (dot(m[0], p), dot(m[1], p), dot(m[2], p))
+
+
+def transpose(m: tuple[Point, Point, Point]) -> tuple[Point, Point, Point]:
+    return (
+        (m[0][0], m[1][0], m[2][0]),
+        (m[0][1], m[1][1], m[2][1]),
+        (m[0][2], m[1][2], m[2][2]),
+    )
+
+
 def rotate(p: Point, axis: Point, angle: float) -> Point:
     ux, uy, uz = axis
     x, y, z = p
@@ -0,0 +1,208 @@
+from dataclasses import dataclass, field, fields, is_dataclass, replace
+from functools import partial
+from time import perf_counter
+from typing import Any, Callable
+import sys
+
+import numpy as np
+
+from point import Point
+from sdf import SDF, Bound, bound, _evaluate, _evaluate_gradient, _value_and_gradient
+from codegen import Compiled
+
+# Batch helpers of sdf.py; the caller of a profiled SDF is whoever called them.
+HELPERS = {
+    "evaluate",
+    "value_and_gradient",
+    "evaluate_gradient",
+    "_evaluate",
+    "_value_and_gradient",
+    "_evaluate_gradient",
+}
+
+
+@dataclass
+class NodeStats:
+    calls: int = 0
+    points: int = 0
+    time: float = 0.0
+    self_time: float = 0.0
+
+    def add(self, other: "NodeStats") -> None:
+        self.calls += other.calls
+        self.points += other.points
+        self.time += other.time
+        self.self_time += other.self_time
+
+
+@dataclass
+class Profile:
+    """Call counts and times of the nodes of one profiled SDF tree.
+
+    Nodes are numbered in the order they were wrapped, parents first. Stats
+    are kept per node and per caller: the function outside sdf.py that called
+    into the root, e.g. `geo.project` or `ray.Ray.propagate`. A node's time
+    includes its children, its self time does not.
+    """
+
+    labels: list[str] = field(default_factory=list)
+    parents: list[int | None] = field(default_factory=list)
+    stats: dict[tuple[int, str], NodeStats] = field(default_factory=dict)
+    # Child time accumulated by each node being evaluated, innermost last.
+    _stack: list[float] = field(default_factory=list, repr=False)
+    _caller: str = field(default="", repr=False)
+
+    def measure(self, node: int, points: int, function: Callable, *args: Any) -> Any:
+        if not self._stack:
+            self._caller = caller()
+        stats = self.stats.get((node, self._caller))
+        if stats is None:
+            stats = self.stats[node, self._caller] = NodeStats()
+        self._stack.append(0.0)
+        start = perf_counter()
+        try:
+            return function(*args)
+        finally:
+            elapsed = perf_counter() - start
+            child_time = self._stack.pop()
+            stats.calls += 1
+            stats.points += points
+            stats.time += elapsed
+            stats.self_time += elapsed - child_time
+            if self._stack:
+                self._stack[-1] += elapsed
+
+    def callers(self) -> list[str]:
+        """Callers by the time they spent in the root, most first."""
+        totals: dict[str, float] = {}
+        for (node, name), stats in self.stats.items():
+            if self.parents[node] is None:
+                totals[name] = totals.get(name, 0.0) + stats.time
+        return sorted(totals, key=totals.get, reverse=True)
+
+    def totals(self, name: str | None = None) -> list[NodeStats]:
+        """Stats of every node, for one caller or summed over all of them."""
+        totals = [NodeStats() for _ in self.labels]
+        for (node, caller_name), stats in self.stats.items():
+            if name is None or caller_name == name:
+                totals[node].add(stats)
+        return totals
+
+    def report(self) -> str:
+        """The node tree with its stats, for all callers and then for each one."""
+        children: list[list[int]] = [[] for _ in self.labels]
+        for node, parent in enumerate(self.parents):
+            if parent is not None:
+                children[parent].append(node)
+        lines = []
+        for name in [None] + self.callers():
+            totals = self.totals(name)
+            lines.append("")
+            lines.append("All callers" if name is None else f"Called from {name}")
+            lines.append(
+                f"{'node':<44} {'calls':>9} {'points':>11} {'time s':>9} {'self s':>9}"
+            )
+
+            def add_lines(node: int, depth: int) -> None:
+                s = totals[node]
+                label = ("  " * depth + self.labels[node])[:44]
+                lines.append(
+                    f"{label:<44} {s.calls:>9} {s.points:>11}"
+                    f" {s.time:>9.4f} {s.self_time:>9.4f}"
+                )
+                for child in children[node]:
+                    add_lines(child, depth + 1)
+
+            for node, parent in enumerate(self.parents):
+                if parent is None:
+                    add_lines(node, 0)
+        return "\n".join(lines[1:])
+
+
+@dataclass
+class Profiled:
+    """Wraps one node of an SDF tree, timing every evaluation in `profile`."""
+
+    sdf: SDF
+    profile: Profile = field(repr=False, compare=False)
+    node: int
+    _batch: Callable = field(init=False, repr=False, compare=False)
+    _gradient: Callable = field(init=False, repr=False, compare=False)
+    _batch_gradient: Callable = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        # Like any node, call the wrapped one through the uncounted helpers.
+        sdf = self.sdf
+        self._batch = partial(_evaluate, sdf)
+        self._gradient = partial(_value_and_gradient, sdf)
+        self._batch_gradient = partial(_evaluate_gradient, sdf)
+
+    def __call__(self, p: Point) -> float:
+        return self.profile.measure(self.node, 1, self.sdf, p)
+
+    def batch(self, ps: np.ndarray) -> np.ndarray:
+        return self.profile.measure(self.node, len(ps), self._batch, ps)
+
+    def gradient(self, p: Point) -> tuple[float, Point]:
+        return self.profile.measure(self.node, 1, self._gradient, p)
+
+    def batch_gradient(self, ps: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        return self.profile.measure(self.node, len(ps), self._batch_gradient, ps)
+
+    def bound(self) -> Bound | None:
+        return bound(self.sdf)
+
+
+def profiled(sdf: SDF, profile: Profile | None = None) -> Profiled:
+    """`sdf` with every node wrapped in a `Profiled` sharing one `Profile`.
+
+    Dataclass nodes are rebuilt with their SDF fields profiled, so the tree
+    evaluates as before, culling included. A `Compiled` SDF runs generated code
+    that does not call its nodes, so it is profiled as a single node. Worker
+    processes profile copies that are lost, so profile with `processes=1`.
+    The results are in the returned root's `profile`; print its `report()`.
+    """
+    if profile is None:
+        profile = Profile()
+    return _wrap(sdf, profile, None)
+
+
+def _wrap(sdf: SDF, profile: Profile, parent: int | None) -> Profiled:
+    node = len(profile.labels)
+    profile.labels.append(label(sdf))
+    profile.parents.append(parent)
+    if is_dataclass(sdf) and not isinstance(sdf, Compiled):
+        changes = {
+            f.name: _wrap(getattr(sdf, f.name), profile, node)
+            for f in fields(sdf)
+            if f.init and callable(getattr(sdf, f.name))
+        }
+        if changes:
+            sdf = replace(sdf, **changes)
+    return Profiled(sdf, profile, node)
+
+
+def label(sdf: SDF) -> str:
+    """The node's class and its parameters that are not SDFs."""
+    if not is_dataclass(sdf):
+        return getattr(sdf, "__qualname__", type(sdf).__name__)
+    if isinstance(sdf, Compiled):
+        return f"Compiled({label(sdf.sdf)})"
+    params = ", ".join(
+        f"{f.name}={getattr(sdf, f.name)!r}"
+        for f in fields(sdf)
+        if f.init and f.repr and not callable(getattr(sdf, f.name))
+    )
+    return f"{type(sdf).__name__}({params})"
+
+
+def caller() -> str:
+    """Module and qualified name of the function that called into the SDF."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        code = frame.f_code
+        if module != __name__ and not (module == "sdf" and code.co_name in HELPERS):
+            return f"{module}.{getattr(code, 'co_qualname', code.co_name)}"
+        frame = frame.f_back
+    return "?"
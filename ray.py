@@ -1,7 +1,11 @@
-from sdf import SDF, normal
-from point import Point, add_mul
+from sdf import SDF, Bound, bound, evaluate, normal, normals
+import instrument
+from point import Point, add_mul, dot, vec
 
 from dataclasses import dataclass
+from math import inf, sqrt
+
+import numpy as np
 
 
 @dataclass
@@ -9,6 +13,23 @@ class Hit:
     hit: bool
     point: Point | None = None
     normal: Point | None = None
+    steps: int = 0
+    evaluations: int = 0
+    distance: float = 0.0
+    value: float | None = None
+
+
+def bound_interval(b: Bound, origin: Point, direction: Point) -> tuple[float, float]:
+    """Distances along the ray where it is inside `b`, (inf, -inf) if never."""
+    oc = vec(b.center, origin)
+    half_b = dot(oc, direction)
+    disc = half_b * half_b - (dot(oc, oc) - b.radius * b.radius)
+    if disc < 0:
+        return inf, -inf
+    root = sqrt(disc)
+    if -half_b + root < 0:
+        return inf, -inf
+    return max(0.0, -half_b - root), -half_b + root
 
 
 @dataclass
@@ -16,25 +37,140 @@ class Ray:
     origin: Point
     direction: Point
 
-    def propagate(self, sdf: SDF, eps: float = 1e-6, max_distance: float = 1e4) -> Hit:
-        if sdf(self.origin) < 0:
-            return Hit(True, self.origin, normal(self.origin, sdf, eps))
-
-        distance_traveled = 0.0
-        num_steps = 0
-        while distance_traveled < max_distance:
-            num_steps += 1
-            step = sdf(self.origin)
-            # print(
-            #     f"Step {num_steps}: sdf value {step}, {self.origin=}, {distance_traveled=}"
-            # )
-            if step < eps:
-                return Hit(True, self.origin, normal(self.origin, sdf, eps))
-            while True:
-                end = add_mul(self.origin, self.direction, step)
-                if sdf(end) >= 0:
-                    break
-                step *= 0.5
-            self.origin = end
-            distance_traveled += step
-        return Hit(False)
+    def propagate(
+        self,
+        sdf: SDF,
+        eps: float = 1e-6,
+        max_distance: float = 1e4,
+        relaxation: float = 1.0,
+    ) -> Hit:
+        """March along the ray with one SDF evaluation per step.
+
+        With `relaxation` > 1 steps are over-relaxed; when the unbounding
+        spheres of two consecutive steps stop overlapping the step is redone
+        with the plain distance and relaxation is switched off for the rest of
+        the ray. The returned `Hit` records the number of steps and SDF
+        evaluations of the march, the distance travelled and the last SDF value.
+
+        If `sdf` has a bound, marching starts where the ray enters it and stops
+        where it leaves it; rays that miss it are not marched at all.
+        """
+        traveled = 0.0
+        b = bound(sdf)
+        if b is not None:
+            enter, leave = bound_interval(
+                Bound(b.center, b.radius + eps), self.origin, self.direction
+            )
+            if enter > leave:
+                return Hit(False)
+            traveled = enter
+            max_distance = min(max_distance, leave)
+        step = 0.0
+        prev_value = 0.0
+        steps = 0
+        evaluations = 0
+        value = None
+        while traveled < max_distance:
+            p = add_mul(self.origin, self.direction, traveled)
+            value = sdf(p)
+            evaluations += 1
+            if relaxation > 1 and abs(value) + prev_value < step:
+                traveled += prev_value - step
+                step = prev_value
+                relaxation = 1.0
+                continue
+            if value < eps:
+                instrument.count("sdf.evaluations", evaluations)
+                instrument.record("march.steps", steps)
+                return Hit(
+                    True,
+                    p,
+                    normal(p, sdf, eps),
+                    steps=steps,
+                    evaluations=evaluations,
+                    distance=traveled,
+                    value=value,
+                )
+            steps += 1
+            step = value * relaxation
+            prev_value = value
+            traveled += step
+        instrument.count("sdf.evaluations", evaluations)
+        instrument.record("march.steps", steps)
+        return Hit(
+            False, steps=steps, evaluations=evaluations, distance=traveled, value=value
+        )
+
+
+@dataclass
+class Hits:
+    hit: np.ndarray
+    points: np.ndarray
+    normals: np.ndarray
+    distances: np.ndarray
+    steps: np.ndarray
+
+
+def march(
+    sdf: SDF,
+    origins: np.ndarray,
+    directions: np.ndarray,
+    *,
+    eps: float = 1e-6,
+    max_distance: float = 1e4,
+    relaxation: float = 1.0,
+) -> Hits:
+    """Sphere trace many rays at once.
+
+    `origins` is a single point or an (N, 3) array, `directions` an (N, 3)
+    array of unit vectors. Each iteration evaluates `sdf` only on the rays that
+    have neither hit nor left `max_distance`; `relaxation` works as in
+    `Ray.propagate`, per ray, and so does the bound early-out. Normals and
+    points of missed rays are NaN, their distance is infinite.
+    """
+    directions = np.asarray(directions, dtype=float)
+    origins = np.broadcast_to(np.asarray(origins, dtype=float), directions.shape)
+    n = len(directions)
+    hit = np.zeros(n, dtype=bool)
+    traveled = np.zeros(n)
+    limit = np.full(n, float(max_distance))
+    b = bound(sdf)
+    if b is not None:
+        oc = origins - b.center
+        half_b = np.einsum("ij,ij->i", oc, directions)
+        radius = b.radius + eps
+        disc = half_b**2 - (np.einsum("ij,ij->i", oc, oc) - radius**2)
+        root = np.sqrt(np.maximum(disc, 0.0))
+        traveled = np.maximum(0.0, -half_b - root)
+        limit = np.where(disc < 0, -inf, np.minimum(limit, -half_b + root))
+    steps = np.zeros(n, dtype=np.int64)
+    step = np.zeros(n)
+    prev_value = np.zeros(n)
+    omega = np.full(n, float(relaxation))
+    active = np.flatnonzero(traveled < limit)
+    while len(active):
+        p = origins[active] + directions[active] * traveled[active, None]
+        value = evaluate(sdf, p)
+        failed = (omega[active] > 1) & (
+            np.abs(value) + prev_value[active] < step[active]
+        )
+        retry = active[failed]
+        traveled[retry] += prev_value[retry] - step[retry]
+        step[retry] = prev_value[retry]
+        omega[retry] = 1.0
+        converged = ~failed & (value < eps)
+        hit[active[converged]] = True
+        moving = ~failed & ~converged
+        advance = active[moving]
+        step[advance] = value[moving] * omega[advance]
+        prev_value[advance] = value[moving]
+        traveled[advance] += step[advance]
+        steps[advance] += 1
+        active = active[~converged]
+        active = active[traveled[active] < limit[active]]
+    points = np.full((n, 3), np.nan)
+    points[hit] = origins[hit] + directions[hit] * traveled[hit, None]
+    hit_normals = np.full((n, 3), np.nan)
+    hit_normals[hit] = normals(points[hit], sdf, eps)
+    instrument.record("march.steps", steps)
+    return Hits(hit, points, hit_normals, np.where(hit, traveled, np.inf), steps)
@@ -1,16 +1,147 @@
-from math import cos, sin, pi, dist
-
-from ray import Ray
-from geo import Connection, Point, SurfacePoint, project_to_surface, connect
-from sdf import SDF, sphere, torus, shifted, rotated, smooth_union
-from point import normalize, cross, add, mul, vec, dot
-from cloud import create_cloud
-from triangulate import Triangle, triangulate
+from math import ceil, pi
+from random import seed
+from threading import Event
+from typing import Callable
+
+from ray import march
+from geo import Point, SurfacePoint
+from geodesic import MeshGeodesics
+from sdf import SDF, torus, shifted, rotated, smooth_union
+from point import normalize, cross
+from cloud import Cloud, as_cloud, create_cloud
+from codegen import compile_sdf
+from triangulate import Mesh, Triangle, as_mesh, triangulate
 from stippling import make_surface, stipple
+from parallel import pool_map
+from artifacts import ArtifactCache, fingerprint
+from export import write_ply
+import instrument
 
+import numpy as np
 from PIL import Image, ImageDraw
 
 
+def ray_directions(
+    direction: Point,
+    right: Point,
+    up: Point,
+    focal_length: float,
+    xs: np.ndarray,
+    ys: np.ndarray,
+) -> np.ndarray:
+    """Unit ray directions through the screen coordinates `xs` x `ys`.
+
+    The result has shape (len(ys), len(xs), 3), row-major like the image.
+    """
+    d = (
+        np.asarray(direction, dtype=float)
+        + np.multiply.outer(xs / focal_length, right)[None, :, :]
+        + np.multiply.outer(ys / focal_length, up)[:, None, :]
+    )
+    return d / np.linalg.norm(d, axis=2, keepdims=True)
+
+
+# Pixel rectangle (left, top, right, bottom) of a tile, right and bottom
+# exclusive as in PIL.
+Box = tuple[int, int, int, int]
+
+
+def tile_boxes(width: int, height: int, tile_size: int) -> list[Box]:
+    """Tiles covering the frame, ordered coarse to fine for previews.
+
+    Tiles on every 8th row and column come first, then those on every 4th,
+    every 2nd and the rest, so early tiles are spread over the whole frame.
+    """
+    boxes = []
+    for ty in range(ceil(height / tile_size)):
+        for tx in range(ceil(width / tile_size)):
+            stride = 8
+            while tx % stride or ty % stride:
+                stride //= 2
+            left = tx * tile_size
+            top = ty * tile_size
+            right = min(left + tile_size, width)
+            bottom = min(top + tile_size, height)
+            boxes.append((-stride, (left, top, right, bottom)))
+    return [box for _, box in sorted(boxes, key=lambda b: b[0])]
+
+
+def _render_tile(
+    task: tuple[SDF, Point, Point, Point, Point, float, float, float, int, int, Box],
+) -> tuple[np.ndarray, np.ndarray]:
+    sdf, origin, direction, right, up, focal_length, eps, max_distance = task[:8]
+    width, height, (left, top, right_edge, bottom) = task[8:]
+    xs = np.arange(left, right_edge) + (-width // 2)
+    ys = np.arange(top, bottom) + (-height // 2)
+    rays = ray_directions(direction, right, up, focal_length, xs, ys)
+    hits = march(
+        sdf,
+        origin,
+        rays.reshape(-1, 3),
+        eps=eps,
+        max_distance=max_distance,
+    )
+    colors = np.where(hits.hit[:, None], (hits.normals + 1) * 128, 0)
+    pixels = np.clip(colors, 0, 255).astype(np.uint8)
+    shape = (len(ys), len(xs))
+    return pixels.reshape(*shape, 3), hits.distances.reshape(shape)
+
+
+@instrument.timed("render_tiles")
+def render_tiles(
+    sdf: SDF,
+    *,
+    origin: Point,
+    direction: Point,
+    up: Point,
+    width: int,
+    height: int,
+    focal_length: float,
+    eps: float,
+    max_distance: float,
+    tile_size: int = 128,
+    processes: int | None = None,
+    on_tile: Callable[[Image.Image, Box], None] | None = None,
+    cancel: Event | None = None,
+) -> tuple[Image.Image, np.ndarray]:
+    """Shade the surface of `sdf` by normals, one tile per pool task.
+
+    Also returns the depth buffer: the (height, width) distances from `origin`
+    to the surface along each pixel's ray, infinite where the ray misses.
+    `on_tile(image, box)` is called with the partially rendered image after
+    each tile is pasted in, in `tile_boxes` order when rendering in this
+    process. Setting `cancel` stops the render after the running tiles; the
+    image is returned with the missing tiles left black and infinitely deep.
+    """
+    right = normalize(cross(direction, up))
+    up = normalize(cross(right, direction))
+    image = Image.new("RGB", (width, height))
+    depth = np.full((height, width), np.inf)
+    boxes = tile_boxes(width, height, tile_size)
+
+    def on_result(i: int, result: tuple[np.ndarray, np.ndarray]) -> None:
+        left, top, right_edge, bottom = boxes[i]
+        pixels, depth[top:bottom, left:right_edge] = result
+        image.paste(Image.fromarray(pixels), (left, top))
+        instrument.progress("render_tiles", i + 1, len(boxes))
+        if on_tile is not None:
+            on_tile(image, boxes[i])
+
+    pool_map(
+        _render_tile,
+        [
+            (sdf, origin, direction, right, up, focal_length, eps, max_distance)
+            + (width, height, box)
+            for box in boxes
+        ],
+        processes=processes,
+        on_result=on_result,
+        cancel=cancel,
+    )
+    return image, depth
+
+
+@instrument.timed("render")
 def render(
     sdf: SDF,
     *,
@@ -22,91 +153,104 @@ def render(
     focal_length: float,
     eps: float,
     max_distance: float,
-    points: list[SurfacePoint],
-    marks: list[Point],
-    triangles: list[Triangle],
+    points: Cloud | list[SurfacePoint],
+    marks: Cloud | list[SurfacePoint],
+    triangles: Mesh | list[Triangle],
     render_surface: bool = True,
     show_surface: bool = True,
+    processes: int | None = None,
+    depth: np.ndarray | None = None,
 ) -> Image:
+    """Draw `marks`, the mesh `triangles` over them and `points` on the surface.
+
+    The surface is rendered when `render_surface` is set, otherwise
+    background.png is reused if `show_surface` is set. Visibility comes from
+    the depth buffer of the surface render, or `depth`, or else the one cached
+    in background_depth.npy.
+    """
+    if render_surface:
+        image, depth = render_tiles(
+            sdf,
+            origin=origin,
+            direction=direction,
+            up=up,
+            width=width,
+            height=height,
+            focal_length=focal_length,
+            eps=eps,
+            max_distance=max_distance,
+            processes=processes,
+        )
+    else:
+        if show_surface:
+            image = Image.open("background.png")
+        else:
+            image = Image.new("RGB", (width, height))
+        if depth is None:
+            depth = np.load("background_depth.npy")
     right = normalize(cross(direction, up))
     up = normalize(cross(right, direction))
-    if render_surface or not show_surface:
-        image = Image.new("RGB", (width, height))
-    else:
-        image = Image.open("background.png")
     draw = ImageDraw.Draw(image)
-    if render_surface:
-        for y in range(-height // 2, height // 2):
-            if y % 20 == 0:
-                print(y)
-            for x in range(-width // 2, width // 2):
-                ray_direction = normalize(
-                    add(
-                        direction,
-                        add(mul(right, x / focal_length), mul(up, y / focal_length)),
-                    )
-                )
-                ray = Ray(origin, ray_direction)
-                hit = ray.propagate(sdf, eps=eps, max_distance=max_distance)
-                if hit.hit:
-                    image.putpixel(
-                        (x + width // 2, y + height // 2),
-                        (
-                            int((hit.normal[0] + 1) * 128),
-                            int((hit.normal[1] + 1) * 128),
-                            int((hit.normal[2] + 1) * 128),
-                        ),
-                    )
-                else:
-                    image.putpixel((x + width // 2, y + height // 2), (0, 0, 0))
-
-    def on_screen(p: SurfacePoint) -> tuple[int, int, bool]:
-        v = normalize(vec(origin, p.point))
-        ray = Ray(origin, v)
-        hit = ray.propagate(sdf, eps=eps, max_distance=max_distance)
-        a = 1 / dot(v, direction)
-        x = int(dot(v, right) * focal_length * a)
-        y = int(dot(v, up) * focal_length * a)
-        return x, y, dist(p.point, hit.point) > 10 * eps if hit.hit else True
-
-    triangle_vertices = set()
-    for tri in triangles:
-        triangle_vertices.add(tri.a_idx)
-        triangle_vertices.add(tri.b_idx)
-        triangle_vertices.add(tri.c_idx)
-        for p, q in [
-            (marks[tri.a_idx], marks[tri.b_idx]),
-            (marks[tri.b_idx], marks[tri.c_idx]),
-            (marks[tri.c_idx], marks[tri.a_idx]),
-        ]:
-            x0, y0, behind0 = on_screen(p)
-            x1, y1, behind1 = on_screen(q)
-            if not behind0 and not behind1:
-                draw.line(
-                    (
-                        x0 + width // 2,
-                        y0 + height // 2,
-                        x1 + width // 2,
-                        y1 + height // 2,
-                    ),
-                    fill=(255, 255, 255),
-                )
 
-    for i, mark in enumerate(marks):
-        x, y, behind = on_screen(mark)
-        if behind:
-            continue
+    def on_screen(
+        ps: Cloud | list[SurfacePoint],
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Pixel offsets from the image center and whether each point is hidden.
+
+        A point is hidden when it is farther than the surface seen at its
+        exact position on screen, interpolated bilinearly between the depths
+        of the pixel rays around it. The interpolation is off by up to a
+        pixel's footprint on grazing surfaces, hence the extra tolerance.
+        """
+        v = as_cloud(ps).positions - origin
+        a = v @ direction
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fx = v @ right * focal_length / a
+            fy = v @ up * focal_length / a
+            px = fx + width // 2
+            py = fy + height // 2
+            hidden = ~(
+                (a > 0) & (px >= 0) & (px <= width - 1) & (py >= 0) & (py <= height - 1)
+            )
+            px = np.where(hidden, 0, px)
+            py = np.where(hidden, 0, py)
+            x0 = np.minimum(px.astype(int), width - 2)
+            y0 = np.minimum(py.astype(int), height - 2)
+            tx = px - x0
+            ty = py - y0
+            top = depth[y0, x0] * (1 - tx) + depth[y0, x0 + 1] * tx
+            bottom = depth[y0 + 1, x0] * (1 - tx) + depth[y0 + 1, x0 + 1] * tx
+            surface = top * (1 - ty) + bottom * ty
+            r = np.linalg.norm(v, axis=1)
+            hidden |= ~np.isfinite(surface)
+            hidden |= r > surface + 10 * eps + r / focal_length
+            return fx.astype(int), fy.astype(int), hidden
+
+    xs, ys, hidden = on_screen(marks)
+    mesh = as_mesh(triangles)
+    triangle_vertices = set(mesh.triangles.ravel().tolist())
+    for p, q in mesh.edges():
+        if not hidden[p] and not hidden[q]:
+            draw.line(
+                (
+                    xs[p] + width // 2,
+                    ys[p] + height // 2,
+                    xs[q] + width // 2,
+                    ys[q] + height // 2,
+                ),
+                fill=(255, 255, 255),
+            )
+
+    for i in np.flatnonzero(~hidden):
         for dx in [-1, 0, 1]:
             for dy in [-1, 0, 1]:
                 image.putpixel(
-                    (x + width // 2 + dx, y + height // 2 + dy),
-                    (255 * (i in triangle_vertices), 255 * behind, 255 * (not behind)),
+                    (xs[i] + width // 2 + dx, ys[i] + height // 2 + dy),
+                    (255 * (i in triangle_vertices), 0, 255),
                 )
 
-    for pt in points:
-        x, y, behind = on_screen(pt)
-        if behind:
-            continue
+    xs, ys, hidden = on_screen(points)
+    for x, y in zip(xs[~hidden], ys[~hidden]):
         image.putpixel((x + width // 2, y + height // 2), (255, 0, 0))
 
     return image
@@ -118,16 +262,18 @@ if __name__ == "__main__":
     up = (0, 0, 1)
     width = 800
     height = 600
-    surface_sdf = smooth_union(
-        shifted(
-            torus(1, 0.5),
-            (-1, 0, 0),
-        ),
-        shifted(
-            rotated(torus(1, 0.5), (1, 0, 0), pi / 2),
-            (1, 0, 0),
-        ),
-        0.5,
+    surface_sdf = compile_sdf(
+        smooth_union(
+            shifted(
+                torus(1, 0.5),
+                (-1, 0, 0),
+            ),
+            shifted(
+                rotated(torus(1, 0.5), (1, 0, 0), pi / 2),
+                (1, 0, 0),
+            ),
+            0.5,
+        )
     )
     # surface_sdf = sphere((0, 0, 0), 1)
 
@@ -143,87 +289,104 @@ if __name__ == "__main__":
         "max_distance": 100.0,
     }
 
-    rerender_background = False
-    if rerender_background:
-        background = render(
-            **render_params,
-            points=[],
-            marks=[],
-            triangles=[],
-            render_surface=True,
-        )
-        background.save("background.png")
-    else:
-        background = Image.open("background.png")
+    metrics = instrument.Metrics()
+    instrument.add_sink(instrument.print_sink)
+    instrument.add_sink(metrics)
+
+    # Every stage is keyed by the fingerprint of its inputs, so only stages
+    # whose SDF, camera or parameters changed are recomputed.
+    cache = ArtifactCache()
 
-    path = []
-    cloud = create_cloud(
-        surface_sdf, num_points=300, near_dist=0.7, step_size=0.02, num_steps=100
+    def render_background() -> dict[str, np.ndarray]:
+        image, depth = render_tiles(**render_params)
+        return {"image": np.asarray(image), "depth": depth}
+
+    background = cache.arrays(
+        "background", fingerprint(render_params), render_background
     )
-    dists = []
-    for i in range(len(cloud)):
-        for j in range(i + 1, len(cloud)):
-            dists.append(dist(cloud[i].point, cloud[j].point))
-    print(min(dists), max(dists))
-    triangles = triangulate(cloud, near_dist=0.7)
-    num_edges = len(
-        {
-            (min(a, b), max(a, b))
-            for tri in triangles
-            for a, b in [
-                (tri.a_idx, tri.b_idx),
-                (tri.b_idx, tri.c_idx),
-                (tri.c_idx, tri.a_idx),
-            ]
-        }
+    Image.fromarray(np.asarray(background["image"])).save("background.png")
+    np.save("background_depth.npy", background["depth"])
+
+    cloud_params = {
+        "num_points": 300,
+        "near_dist": 0.7,
+        "step_size": 0.02,
+        "num_steps": 100,
+    }
+    cloud_key = fingerprint(surface_sdf, cloud_params)
+    cloud = cache.cloud(
+        "cloud",
+        cloud_key,
+        surface_sdf,
+        lambda: create_cloud(surface_sdf, **cloud_params),
     )
+    positions = cloud.positions
+    dists = np.linalg.norm(positions[:, None] - positions[None], axis=2)[
+        np.triu_indices(len(positions), 1)
+    ]
+    print(dists.min(), dists.max())
+    mesh_key = fingerprint(cloud_key, 0.7)
+    triangles = cache.mesh("mesh", mesh_key, lambda: triangulate(cloud, near_dist=0.7))
+    num_edges = len(triangles.edges())
     num_vertices = len(cloud)
     num_faces = len(triangles)
     print(f"Vertices: {num_vertices}, Edges: {num_edges}, Faces: {num_faces}")
     print(f"Euler characteristic: {num_vertices - num_edges + num_faces}")
     image = render(
         **render_params,
-        points=path,
+        points=[],
         marks=cloud,
         triangles=triangles,
         render_surface=False,
         show_surface=True,
     )
     image.save("mesh.png")
+    write_ply("mesh.ply", cloud, triangles)
 
-    surface = make_surface(surface_sdf, cloud, triangles)
-    stippled_points = stipple(surface, num_points=200, num_iters=100000)
+    def stipple_points() -> Cloud:
+        seed(42)
+        surface = make_surface(surface_sdf, cloud, triangles)
+        return stipple(surface, num_points=200, num_iters=100000)
 
-    dists: dict[tuple[int, int], Connection] = {}
+    stipple_key = fingerprint(mesh_key, 200, 100000, 42)
+    stippled_points = cache.cloud("stipple", stipple_key, surface_sdf, stipple_points)
+    stippled_key = fingerprint(stipple_key, 0.7)
+    stippled_triangles = cache.mesh(
+        "stippled_mesh",
+        stippled_key,
+        lambda: triangulate(stippled_points, near_dist=0.7),
+    )
 
-    def get_dist(i: int, j: int) -> Connection:
-        if i > j:
-            i, j = j, i
-        if (i, j) in dists:
-            return Connection([], float("inf"))
-        p = stippled_points[i].point
-        q = stippled_points[j].point
-        dists[(i, j)] = connect(
+    def geodesic_paths() -> Cloud:
+        geodesics = MeshGeodesics(surface_sdf, cloud, triangles)
+        stippled_positions = [tuple(p) for p in stippled_points.positions.tolist()]
+        connections = geodesics.connect_many(
+            [
+                (stippled_positions[i], stippled_positions[j])
+                for i, j in stippled_triangles.edges().tolist()
+            ],
+        )
+        paths = [connection.path.resample(1e-2) for connection in connections]
+        return Cloud(
             surface_sdf,
-            p,
-            q,
-            eps=1e-3,
+            np.concatenate([p.points for p in paths]),
+            np.concatenate([p.normals for p in paths]),
+            np.concatenate([p.directions for p in paths]),
         )
-        return dists[(i, j)]
 
-    stippled_triangles = triangulate(stippled_points, near_dist=0.7)
-    for idx, tri in enumerate(stippled_triangles):
-        print(f"Stippled triangle {idx + 1}/{len(stippled_triangles)}")
-        for i in range(3):
-            idxs = [tri.a_idx, tri.b_idx, tri.c_idx]
-            path += get_dist(idxs[i], idxs[(i + 1) % 3]).points
+    paths = cache.cloud(
+        "paths", fingerprint(mesh_key, stippled_key, 1e-2), surface_sdf, geodesic_paths
+    )
 
     image = render(
         **render_params,
-        points=path,
+        points=paths,
         marks=stippled_points,
         triangles=[],
         render_surface=False,
         show_surface=True,
     )
     image.save("stippled.png")
+    write_ply("stippled.ply", stippled_points, stippled_triangles)
+    instrument.flush()
+    print(metrics.report())
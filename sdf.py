@@ -1,101 +1,634 @@
+from dataclasses import dataclass, field, fields, is_dataclass
 from typing import Callable
-from math import hypot, dist
-
-from point import Point, add, vec, normalize, rotate
+from math import hypot, dist, inf
+
+import numpy as np
+
+import instrument
+from point import (
+    Point,
+    add,
+    mul,
+    vec,
+    normalize,
+    rotation_matrix,
+    transform,
+    transpose,
+)
 
 SDF = Callable[[Point], float]
+# Gradients divide by distances to a centre, axis or circle. Closer than this
+# the direction is undefined and a fixed one is returned instead.
+TINY = 1e-12
 
 
-def normal(p: Point, sdf: SDF, eps: float = 1e-6) -> Point:
+def evaluate(sdf: SDF, ps: np.ndarray) -> np.ndarray:
+    """Evaluate `sdf` at each row of the (N, 3) array `ps`.
+
+    SDFs built from this module evaluate the whole array at once, any other
+    callable falls back to one call per point.
+    """
+    ps = np.asarray(ps, dtype=float)
+    instrument.count("sdf.evaluations", len(ps))
+    return _evaluate(sdf, ps)
+
+
+def _evaluate(sdf: SDF, ps: np.ndarray) -> np.ndarray:
+    # Nodes evaluate their children through the uncounted helpers, so the
+    # counts are of points asked of the whole tree, whatever its depth.
+    if hasattr(sdf, "batch"):
+        return sdf.batch(ps)
+    return np.fromiter((sdf(tuple(p)) for p in ps), dtype=float, count=len(ps))
+
+
+def children(sdf: SDF) -> list[SDF]:
+    """The SDFs `sdf` is built from, empty for primitives and plain callables."""
+    if not is_dataclass(sdf):
+        return []
+    return [
+        getattr(sdf, f.name)
+        for f in fields(sdf)
+        if f.init and callable(getattr(sdf, f.name))
+    ]
+
+
+def value_and_gradient(sdf: SDF, p: Point, eps: float = 1e-6) -> tuple[float, Point]:
+    """The value of `sdf` at `p` and its gradient.
+
+    SDFs built from this module know their gradient analytically, for any other
+    callable it is estimated with central differences of step `eps`.
+    """
+    instrument.count("sdf.gradients")
+    return _value_and_gradient(sdf, p, eps)
+
+
+def _value_and_gradient(sdf: SDF, p: Point, eps: float = 1e-6) -> tuple[float, Point]:
+    if hasattr(sdf, "gradient"):
+        return sdf.gradient(p)
     dx = sdf(add(p, (eps, 0, 0))) - sdf(add(p, (-eps, 0, 0)))
     dy = sdf(add(p, (0, eps, 0))) - sdf(add(p, (0, -eps, 0)))
     dz = sdf(add(p, (0, 0, eps))) - sdf(add(p, (0, 0, -eps)))
-    return normalize((dx, dy, dz))
+    return sdf(p), mul((dx, dy, dz), 0.5 / eps)
 
 
-def sphere(center: Point, r: float) -> SDF:
-    def sdf(p: Point) -> float:
-        return dist(p, center) - r
+def evaluate_gradient(
+    sdf: SDF, ps: np.ndarray, eps: float = 1e-6
+) -> tuple[np.ndarray, np.ndarray]:
+    """Batched `value_and_gradient`: values (N,) and gradients (N, 3)."""
+    ps = np.asarray(ps, dtype=float)
+    instrument.count("sdf.gradients", len(ps))
+    return _evaluate_gradient(sdf, ps, eps)
 
-    return sdf
 
+def _evaluate_gradient(
+    sdf: SDF, ps: np.ndarray, eps: float = 1e-6
+) -> tuple[np.ndarray, np.ndarray]:
+    if hasattr(sdf, "batch_gradient"):
+        return sdf.batch_gradient(ps)
+    grad = np.empty_like(ps)
+    for axis in range(3):
+        offset = np.zeros(3)
+        offset[axis] = eps
+        grad[:, axis] = _evaluate(sdf, ps + offset) - _evaluate(sdf, ps - offset)
+    return _evaluate(sdf, ps), grad * (0.5 / eps)
 
-def torus(r1: float, r2: float) -> SDF:
-    def sdf(p: Point) -> float:
-        return hypot(hypot(p[0], p[2]) - r1, p[1]) - r2
 
-    return sdf
+def normal(p: Point, sdf: SDF, eps: float = 1e-6) -> Point:
+    return normalize(value_and_gradient(sdf, p, eps)[1])
+
+
+def normals(ps: np.ndarray, sdf: SDF, eps: float = 1e-6) -> np.ndarray:
+    """Batched `normal`: unit normals at each row of `ps`."""
+    grad = evaluate_gradient(sdf, ps, eps)[1]
+    return grad / np.linalg.norm(grad, axis=1, keepdims=True)
+
+
+@dataclass
+class Bound:
+    """A sphere that bounds an SDF from below.
+
+    For every point `p`, `sdf(p) >= dist(p, center) - radius`, so the SDF is
+    positive outside the sphere and no closer to zero than the sphere surface.
+    """
+
+    center: Point
+    radius: float
+
+    def lower(self, p: Point) -> float:
+        return dist(p, self.center) - self.radius
+
+    def lower_batch(self, ps: np.ndarray) -> np.ndarray:
+        return np.linalg.norm(ps - self.center, axis=1) - self.radius
+
+
+def bound(sdf: SDF) -> Bound | None:
+    """The bounding sphere of `sdf`, None if it is unbounded or unknown."""
+    if hasattr(sdf, "bound"):
+        return sdf.bound()
+    return None
+
+
+def enclose(b1: Bound | None, b2: Bound | None) -> Bound | None:
+    """The smallest sphere containing both spheres."""
+    if b1 is None or b2 is None:
+        return None
+    d = dist(b1.center, b2.center)
+    if d + b2.radius <= b1.radius:
+        return b1
+    if d + b1.radius <= b2.radius:
+        return b2
+    radius = (d + b1.radius + b2.radius) / 2
+    t = (radius - b1.radius) / d
+    center = add(b1.center, mul(vec(b1.center, b2.center), t))
+    return Bound(center, radius)
+
+
+def tighter(b1: Bound | None, b2: Bound | None) -> Bound | None:
+    if b1 is None:
+        return b2
+    if b2 is None or b1.radius <= b2.radius:
+        return b1
+    return b2
+
+
+def culled(
+    sdf1: SDF,
+    bound1: Bound | None,
+    sdf2: SDF,
+    bound2: Bound | None,
+    p: Point,
+    margin: float,
+) -> tuple[float, float]:
+    """Values of both children of a union at `p`, skipping one if possible.
+
+    The child whose bound is nearer is evaluated first. The other is only
+    evaluated if its bound is within `margin` of that value; if it is not,
+    the min (or smooth min with `k = margin`) picks the first child anyway, so
+    it is reported as slightly more than `margin` above it.
+    """
+    l1 = bound1.lower(p) if bound1 is not None else -inf
+    l2 = bound2.lower(p) if bound2 is not None else -inf
+    if l1 <= l2:
+        d1 = sdf1(p)
+        d2 = sdf2(p) if l2 < d1 + margin else d1 + margin + 1.0
+    else:
+        d2 = sdf2(p)
+        d1 = sdf1(p) if l1 < d2 + margin else d2 + margin + 1.0
+    return d1, d2
+
+
+def culled_gradients(
+    sdf1: SDF,
+    bound1: Bound | None,
+    sdf2: SDF,
+    bound2: Bound | None,
+    p: Point,
+    margin: float,
+) -> tuple[tuple[float, Point], tuple[float, Point]]:
+    """`culled` for `value_and_gradient`; skipped gradients are zero."""
+    l1 = bound1.lower(p) if bound1 is not None else -inf
+    l2 = bound2.lower(p) if bound2 is not None else -inf
+    if l1 <= l2:
+        first = _value_and_gradient(sdf1, p)
+        if l2 < first[0] + margin:
+            return first, _value_and_gradient(sdf2, p)
+        return first, (first[0] + margin + 1.0, (0.0, 0.0, 0.0))
+    second = _value_and_gradient(sdf2, p)
+    if l1 < second[0] + margin:
+        return _value_and_gradient(sdf1, p), second
+    return (second[0] + margin + 1.0, (0.0, 0.0, 0.0)), second
+
+
+def culled_batch(
+    sdf1: SDF,
+    sdf2: SDF,
+    bound2: Bound | None,
+    ps: np.ndarray,
+    margin: float,
+    gradients: bool = False,
+) -> tuple:
+    """Batched `culled` (or `culled_gradients` with `gradients`).
+
+    Each child is called at most once: the first on every row, the second only
+    on the rows where its bound is within `margin` of the first value. Returns
+    `(d1, d2)`, or `((d1, g1), (d2, g2))` with `gradients`.
+    """
+    if gradients:
+        d1, g1 = _evaluate_gradient(sdf1, ps)
+    else:
+        d1 = _evaluate(sdf1, ps)
+    if bound2 is None:
+        rows = slice(None)
+    else:
+        rows = np.flatnonzero(bound2.lower_batch(ps) < d1 + margin)
+    d2 = d1 + margin + 1.0
+    if gradients:
+        g2 = np.zeros_like(ps)
+        d2[rows], g2[rows] = _evaluate_gradient(sdf2, ps[rows])
+        return (d1, g1), (d2, g2)
+    d2[rows] = _evaluate(sdf2, ps[rows])
+    return d1, d2
+
+
+@dataclass
+class Sphere:
+    center: Point
+    r: float
+
+    def __call__(self, p: Point) -> float:
+        return dist(p, self.center) - self.r
+
+    def batch(self, ps: np.ndarray) -> np.ndarray:
+        return np.linalg.norm(ps - self.center, axis=1) - self.r
+
+    def gradient(self, p: Point) -> tuple[float, Point]:
+        v = vec(self.center, p)
+        length = dist(p, self.center)
+        if length < TINY:
+            return length - self.r, (0.0, 1.0, 0.0)
+        return length - self.r, mul(v, 1 / length)
+
+    def batch_gradient(self, ps: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        v = ps - self.center
+        length = np.linalg.norm(v, axis=1)
+        grad = v / np.maximum(length, TINY)[:, None]
+        grad[length < TINY] = (0.0, 1.0, 0.0)
+        return length - self.r, grad
+
+    def bound(self) -> Bound | None:
+        return Bound(self.center, self.r)
+
+
+@dataclass
+class Torus:
+    r1: float
+    r2: float
+
+    def __call__(self, p: Point) -> float:
+        return hypot(hypot(p[0], p[2]) - self.r1, p[1]) - self.r2
+
+    def batch(self, ps: np.ndarray) -> np.ndarray:
+        return np.hypot(np.hypot(ps[:, 0], ps[:, 2]) - self.r1, ps[:, 1]) - self.r2
+
+    def gradient(self, p: Point) -> tuple[float, Point]:
+        # On the y axis every radial direction is as good, take +x; on the
+        # core circle, point away from the axis.
+        q = hypot(p[0], p[2])
+        ux, uz = (p[0] / q, p[2] / q) if q >= TINY else (1.0, 0.0)
+        a = q - self.r1
+        length = hypot(a, p[1])
+        if length < TINY:
+            return length - self.r2, (ux, 0.0, uz)
+        s = a / length
+        return length - self.r2, (ux * s, p[1] / length, uz * s)
+
+    def batch_gradient(self, ps: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        q = np.hypot(ps[:, 0], ps[:, 2])
+        axis = q < TINY
+        safe_q = np.maximum(q, TINY)
+        ux = np.where(axis, 1.0, ps[:, 0] / safe_q)
+        uz = np.where(axis, 0.0, ps[:, 2] / safe_q)
+        a = q - self.r1
+        length = np.hypot(a, ps[:, 1])
+        core = length < TINY
+        safe_length = np.maximum(length, TINY)
+        s = np.where(core, 1.0, a / safe_length)
+        y = np.where(core, 0.0, ps[:, 1] / safe_length)
+        grad = np.stack([ux * s, y, uz * s], axis=1)
+        return length - self.r2, grad
+
+    def bound(self) -> Bound | None:
+        return Bound((0.0, 0.0, 0.0), self.r1 + self.r2)
+
+
+@dataclass
+class Shifted:
+    sdf: SDF
+    offset: Point
+
+    def __call__(self, p: Point) -> float:
+        return self.sdf(add(p, self.offset))
+
+    def batch(self, ps: np.ndarray) -> np.ndarray:
+        return _evaluate(self.sdf, ps + self.offset)
+
+    def gradient(self, p: Point) -> tuple[float, Point]:
+        return _value_and_gradient(self.sdf, add(p, self.offset))
+
+    def batch_gradient(self, ps: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        return _evaluate_gradient(self.sdf, ps + self.offset)
+
+    def bound(self) -> Bound | None:
+        b = bound(self.sdf)
+        return b and Bound(vec(self.offset, b.center), b.radius)
+
+
+@dataclass
+class Rotated:
+    sdf: SDF
+    axis: Point
+    angle: float
+    matrix: tuple[Point, Point, Point] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        self.matrix = rotation_matrix(self.axis, self.angle)
+
+    def __call__(self, p: Point) -> float:
+        return self.sdf(transform(self.matrix, p))
+
+    def batch(self, ps: np.ndarray) -> np.ndarray:
+        return _evaluate(self.sdf, ps @ np.transpose(self.matrix))
+
+    def gradient(self, p: Point) -> tuple[float, Point]:
+        # d/dp f(Mp) = M^T grad f(Mp)
+        value, grad = _value_and_gradient(self.sdf, transform(self.matrix, p))
+        return value, transform(transpose(self.matrix), grad)
+
+    def batch_gradient(self, ps: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        values, grad = _evaluate_gradient(self.sdf, ps @ np.transpose(self.matrix))
+        return values, grad @ np.array(self.matrix)
+
+    def bound(self) -> Bound | None:
+        b = bound(self.sdf)
+        return b and Bound(transform(transpose(self.matrix), b.center), b.radius)
+
+
+@dataclass
+class Cube:
+    center: Point
+    size: float
+
+    def __call__(self, p: Point) -> float:
+        d = vec(p, self.center)
+        return max(abs(d[0]), max(abs(d[1]), abs(d[2]))) - self.size
+
+    def batch(self, ps: np.ndarray) -> np.ndarray:
+        return np.max(np.abs(ps - self.center), axis=1) - self.size
+
+    def gradient(self, p: Point) -> tuple[float, Point]:
+        d = vec(self.center, p)
+        axis = max(range(3), key=lambda i: abs(d[i]))
+        grad = [0.0, 0.0, 0.0]
+        grad[axis] = 1.0 if d[axis] >= 0 else -1.0
+        return abs(d[axis]) - self.size, tuple(grad)
+
+    def batch_gradient(self, ps: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        d = ps - self.center
+        axis = np.argmax(np.abs(d), axis=1)
+        rows = np.arange(len(ps))
+        grad = np.zeros_like(d)
+        grad[rows, axis] = np.where(d[rows, axis] >= 0, 1.0, -1.0)
+        return np.abs(d[rows, axis]) - self.size, grad
 
+    def bound(self) -> Bound | None:
+        # The Chebyshev distance underestimates the Euclidean one along the
+        # diagonals without limit, so no sphere bounds it from below.
+        return None
 
-def shifted(sdf: SDF, offset: Point) -> SDF:
-    def sdf_shifted(p: Point) -> float:
-        return sdf(add(p, offset))
 
-    return sdf_shifted
+@dataclass
+class Union:
+    sdf1: SDF
+    sdf2: SDF
+    bound1: Bound | None = field(init=False, repr=False, compare=False)
+    bound2: Bound | None = field(init=False, repr=False, compare=False)
 
+    def __post_init__(self) -> None:
+        self.bound1 = bound(self.sdf1)
+        self.bound2 = bound(self.sdf2)
 
-def rotated(sdf: SDF, axis: Point, angle: float) -> SDF:
-    def sdf_rotated(p: Point) -> float:
-        return sdf(rotate(p, axis, angle))
+    def __call__(self, p: Point) -> float:
+        return min(*culled(self.sdf1, self.bound1, self.sdf2, self.bound2, p, 0.0))
 
-    return sdf_rotated
+    def batch(self, ps: np.ndarray) -> np.ndarray:
+        return np.minimum(*culled_batch(self.sdf1, self.sdf2, self.bound2, ps, 0.0))
 
+    def gradient(self, p: Point) -> tuple[float, Point]:
+        (d1, g1), (d2, g2) = culled_gradients(
+            self.sdf1, self.bound1, self.sdf2, self.bound2, p, 0.0
+        )
+        return (d1, g1) if d1 <= d2 else (d2, g2)
 
-def cube(center: Point, size: float) -> SDF:
-    def sdf(p: Point) -> float:
-        d = vec(p, center)
-        return max(abs(d[0]), max(abs(d[1]), abs(d[2]))) - size
+    def batch_gradient(self, ps: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        (d1, g1), (d2, g2) = culled_batch(
+            self.sdf1, self.sdf2, self.bound2, ps, 0.0, gradients=True
+        )
+        first = d1 <= d2
+        return np.where(first, d1, d2), np.where(first[:, None], g1, g2)
 
-    return sdf
+    def bound(self) -> Bound | None:
+        return enclose(self.bound1, self.bound2)
 
 
-def union(sdf1: SDF, sdf2: SDF) -> SDF:
-    def sdf(p: Point) -> float:
-        return min(sdf1(p), sdf2(p))
+@dataclass
+class Intersection:
+    sdf1: SDF
+    sdf2: SDF
 
-    return sdf
+    def __call__(self, p: Point) -> float:
+        return max(self.sdf1(p), self.sdf2(p))
 
+    def batch(self, ps: np.ndarray) -> np.ndarray:
+        return np.maximum(_evaluate(self.sdf1, ps), _evaluate(self.sdf2, ps))
 
-def intersection(sdf1: SDF, sdf2: SDF) -> SDF:
-    def sdf(p: Point) -> float:
-        return max(sdf1(p), sdf2(p))
+    def gradient(self, p: Point) -> tuple[float, Point]:
+        d1, g1 = _value_and_gradient(self.sdf1, p)
+        d2, g2 = _value_and_gradient(self.sdf2, p)
+        return (d1, g1) if d1 >= d2 else (d2, g2)
 
-    return sdf
+    def batch_gradient(self, ps: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        d1, g1 = _evaluate_gradient(self.sdf1, ps)
+        d2, g2 = _evaluate_gradient(self.sdf2, ps)
+        first = d1 >= d2
+        return np.where(first, d1, d2), np.where(first[:, None], g1, g2)
+
+    def bound(self) -> Bound | None:
+        return tighter(bound(self.sdf1), bound(self.sdf2))
 
 
 def mix(a: float, b: float, t: float) -> float:
     return a * (1 - t) + b * t
 
 
+def mix_gradients(g1: Point, g2: Point, t: float) -> Point:
+    return add(mul(g1, 1 - t), mul(g2, t))
+
+
 def clamp(x: float, min_val: float, max_val: float) -> float:
     return max(min_val, min(x, max_val))
 
 
-def smooth_union(sdf1: SDF, sdf2: SDF, k: float) -> SDF:
-    def sdf(p: Point) -> float:
-        d1 = sdf1(p)
-        d2 = sdf2(p)
-        h = clamp(0.5 + 0.5 * (d2 - d1) / k, 0.0, 1.0)
-        return mix(d2, d1, h) - k * h * (1.0 - h)
+@dataclass
+class SmoothUnion:
+    sdf1: SDF
+    sdf2: SDF
+    k: float
+    bound1: Bound | None = field(init=False, repr=False, compare=False)
+    bound2: Bound | None = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        self.bound1 = bound(self.sdf1)
+        self.bound2 = bound(self.sdf2)
+
+    def __call__(self, p: Point) -> float:
+        d1, d2 = culled(self.sdf1, self.bound1, self.sdf2, self.bound2, p, self.k)
+        h = clamp(0.5 + 0.5 * (d2 - d1) / self.k, 0.0, 1.0)
+        return mix(d2, d1, h) - self.k * h * (1.0 - h)
+
+    def batch(self, ps: np.ndarray) -> np.ndarray:
+        d1, d2 = culled_batch(self.sdf1, self.sdf2, self.bound2, ps, self.k)
+        h = np.clip(0.5 + 0.5 * (d2 - d1) / self.k, 0.0, 1.0)
+        return mix(d2, d1, h) - self.k * h * (1.0 - h)
+
+    def gradient(self, p: Point) -> tuple[float, Point]:
+        (d1, g1), (d2, g2) = culled_gradients(
+            self.sdf1, self.bound1, self.sdf2, self.bound2, p, self.k
+        )
+        h = clamp(0.5 + 0.5 * (d2 - d1) / self.k, 0.0, 1.0)
+        value = mix(d2, d1, h) - self.k * h * (1.0 - h)
+        return value, mix_gradients(g2, g1, h)
+
+    def batch_gradient(self, ps: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        (d1, g1), (d2, g2) = culled_batch(
+            self.sdf1, self.sdf2, self.bound2, ps, self.k, gradients=True
+        )
+        h = np.clip(0.5 + 0.5 * (d2 - d1) / self.k, 0.0, 1.0)
+        value = mix(d2, d1, h) - self.k * h * (1.0 - h)
+        return value, mix(g2, g1, h[:, None])
+
+    def bound(self) -> Bound | None:
+        # The smooth minimum is at most k / 4 below the minimum.
+        b = enclose(self.bound1, self.bound2)
+        return b and Bound(b.center, b.radius + self.k / 4)
+
+
+@dataclass
+class SmoothIntersection:
+    sdf1: SDF
+    sdf2: SDF
+    k: float
+
+    def __call__(self, p: Point) -> float:
+        d1 = self.sdf1(p)
+        d2 = self.sdf2(p)
+        h = clamp(0.5 - 0.5 * (d2 - d1) / self.k, 0.0, 1.0)
+        return mix(d2, d1, h) + self.k * h * (1.0 - h)
+
+    def batch(self, ps: np.ndarray) -> np.ndarray:
+        d1 = _evaluate(self.sdf1, ps)
+        d2 = _evaluate(self.sdf2, ps)
+        h = np.clip(0.5 - 0.5 * (d2 - d1) / self.k, 0.0, 1.0)
+        return mix(d2, d1, h) + self.k * h * (1.0 - h)
+
+    def gradient(self, p: Point) -> tuple[float, Point]:
+        d1, g1 = _value_and_gradient(self.sdf1, p)
+        d2, g2 = _value_and_gradient(self.sdf2, p)
+        h = clamp(0.5 - 0.5 * (d2 - d1) / self.k, 0.0, 1.0)
+        value = mix(d2, d1, h) + self.k * h * (1.0 - h)
+        return value, mix_gradients(g2, g1, h)
+
+    def batch_gradient(self, ps: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        d1, g1 = _evaluate_gradient(self.sdf1, ps)
+        d2, g2 = _evaluate_gradient(self.sdf2, ps)
+        h = np.clip(0.5 - 0.5 * (d2 - d1) / self.k, 0.0, 1.0)
+        value = mix(d2, d1, h) + self.k * h * (1.0 - h)
+        return value, mix(g2, g1, h[:, None])
+
+    def bound(self) -> Bound | None:
+        # The smooth maximum is never below the maximum.
+        return tighter(bound(self.sdf1), bound(self.sdf2))
+
+
+@dataclass
+class SmoothSubtraction:
+    sdf1: SDF
+    sdf2: SDF
+    k: float
+
+    def __call__(self, p: Point) -> float:
+        d1 = self.sdf1(p)
+        d2 = self.sdf2(p)
+        h = clamp(0.5 - 0.5 * (d2 + d1) / self.k, 0.0, 1.0)
+        return mix(d2, -d1, h) + self.k * h * (1.0 - h)
+
+    def batch(self, ps: np.ndarray) -> np.ndarray:
+        d1 = _evaluate(self.sdf1, ps)
+        d2 = _evaluate(self.sdf2, ps)
+        h = np.clip(0.5 - 0.5 * (d2 + d1) / self.k, 0.0, 1.0)
+        return mix(d2, -d1, h) + self.k * h * (1.0 - h)
+
+    def gradient(self, p: Point) -> tuple[float, Point]:
+        d1, g1 = _value_and_gradient(self.sdf1, p)
+        d2, g2 = _value_and_gradient(self.sdf2, p)
+        h = clamp(0.5 - 0.5 * (d2 + d1) / self.k, 0.0, 1.0)
+        value = mix(d2, -d1, h) + self.k * h * (1.0 - h)
+        return value, mix_gradients(g2, mul(g1, -1), h)
+
+    def batch_gradient(self, ps: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        d1, g1 = _evaluate_gradient(self.sdf1, ps)
+        d2, g2 = _evaluate_gradient(self.sdf2, ps)
+        h = np.clip(0.5 - 0.5 * (d2 + d1) / self.k, 0.0, 1.0)
+        value = mix(d2, -d1, h) + self.k * h * (1.0 - h)
+        return value, mix(g2, -g1, h[:, None])
+
+    def bound(self) -> Bound | None:
+        return bound(self.sdf2)
 
-    return sdf
 
+def sphere(center: Point, r: float) -> SDF:
+    return Sphere(center, r)
 
-def smooth_intersection(sdf1: SDF, sdf2: SDF, k: float) -> SDF:
-    def sdf(p: Point) -> float:
-        d1 = sdf1(p)
-        d2 = sdf2(p)
-        h = clamp(0.5 - 0.5 * (d2 - d1) / k, 0.0, 1.0)
-        return mix(d2, d1, h) + k * h * (1.0 - h)
 
-    return sdf
+def torus(r1: float, r2: float) -> SDF:
+    return Torus(r1, r2)
 
 
-def smooth_subtraction(sdf1: SDF, sdf2: SDF, k: float) -> SDF:
-    def sdf(p: Point) -> float:
-        d1 = sdf1(p)
-        d2 = sdf2(p)
-        h = clamp(0.5 - 0.5 * (d2 + d1) / k, 0.0, 1.0)
-        return mix(d2, -d1, h) + k * h * (1.0 - h)
+def shifted(sdf: SDF, offset: Point) -> SDF:
+    return Shifted(sdf, offset)
+
+
+def rotated(sdf: SDF, axis: Point, angle: float) -> SDF:
+    return Rotated(sdf, axis, angle)
+
+
+def cube(center: Point, size: float) -> SDF:
+    return Cube(center, size)
 
-    return sdf
+
+def union(sdf1: SDF, sdf2: SDF) -> SDF:
+    return Union(sdf1, sdf2)
+
+
+def intersection(sdf1: SDF, sdf2: SDF) -> SDF:
+    return Intersection(sdf1, sdf2)
+
+
+def smooth_union(sdf1: SDF, sdf2: SDF, k: float) -> SDF:
+    return SmoothUnion(sdf1, sdf2, k)
+
+
+def smooth_intersection(sdf1: SDF, sdf2: SDF, k: float) -> SDF:
+    return SmoothIntersection(sdf1, sdf2, k)
+
+
+def smooth_subtraction(sdf1: SDF, sdf2: SDF, k: float) -> SDF:
+    return SmoothSubtraction(sdf1, sdf2, k)
+
+
+def union_all(sdfs: list[SDF]) -> SDF:
+    """Union of many SDFs as a balanced tree of spatially close groups.
+
+    Splitting along the widest spread of the bound centers keeps the bounds of
+    the inner nodes tight, so evaluation skips whole far away groups.
+    """
+    if not sdfs:
+        raise ValueError("union_all needs at least one SDF")
+    if len(sdfs) == 1:
+        return sdfs[0]
+    bounds = [bound(s) for s in sdfs]
+    if all(b is not None for b in bounds):
+        centers = np.array([b.center for b in bounds])
+        axis = int(np.argmax(centers.max(axis=0) - centers.min(axis=0)))
+        sdfs = [sdfs[i] for i in np.argsort(centers[:, axis], kind="stable")]
+    half = len(sdfs) // 2
+    return union(union_all(sdfs[:half]), union_all(sdfs[half:]))
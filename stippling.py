@@ -1,28 +1,35 @@
 from dataclasses import dataclass
-from math import dist
+from math import inf, pi, sqrt
 from random import uniform
-import bisect
+
+import numpy as np
 
 from sdf import SDF
-from geo import SurfacePoint, project_to_surface
-from triangulate import Triangle
+from geo import SurfacePoint, project, project_many, project_to_surface
+from grid import Grid, pairs_between, pairs_within
+from cloud import Cloud, as_cloud, make_cloud
+from triangulate import Mesh, Triangle, as_mesh
 from point import vec, add, mul, add_mul
+import instrument
+
+# Fraction of the plane covered by disks of diameter `spacing` when random dart
+# throwing saturates, i.e. no more centers fit at least `spacing` apart.
+SATURATED_COVERAGE = 0.547
 
 
 @dataclass
 class Surface:
     sdf: SDF
-    vertices: list[SurfacePoint]
-    triangles: list[Triangle]
-    cumulative_areas: list[float]
+    vertices: Cloud
+    triangles: Mesh
+    cumulative_areas: np.ndarray
 
     def get_random_point(self) -> SurfacePoint:
         total_area = self.cumulative_areas[-1]
         r = uniform(0, total_area)
-        triangle = self.triangles[bisect.bisect_right(self.cumulative_areas, r)]
-        a = self.vertices[triangle.a_idx].point
-        b = self.vertices[triangle.b_idx].point
-        c = self.vertices[triangle.c_idx].point
+        triangle = np.searchsorted(self.cumulative_areas, r, side="right")
+        corners = self.triangles.triangles[triangle]
+        a, b, c = map(tuple, self.vertices.positions[corners].tolist())
         x = uniform(0, 1)
         y = uniform(0, 1)
         u = min(x, y)
@@ -30,41 +37,193 @@ class Surface:
         p = add(mul(a, u), add(mul(b, v - u), mul(c, 1 - v)))
         return project_to_surface(self.sdf, p=p, direction=(1, 0, 0))
 
+    def get_random_points(
+        self, n: int, rng: np.random.Generator | None = None
+    ) -> np.ndarray:
+        """`n` area-weighted random points on the triangles, not projected."""
+        if rng is None:
+            rng = np.random.default_rng()
+        r = rng.uniform(0, self.cumulative_areas[-1], n)
+        idx = np.searchsorted(self.cumulative_areas, r, side="right")
+        idx = np.minimum(idx, len(self.triangles) - 1)
+        corners = self.triangles.triangles[idx]
+        positions = self.vertices.positions
+        xy = rng.uniform(0, 1, (n, 2))
+        u = xy.min(axis=1)[:, None]
+        v = xy.max(axis=1)[:, None]
+        return (
+            positions[corners[:, 0]] * u
+            + positions[corners[:, 1]] * (v - u)
+            + positions[corners[:, 2]] * (1 - v)
+        )
+
 
 def make_surface(
-    sdf: SDF, vertices: list[SurfacePoint], triangles: list[Triangle]
+    sdf: SDF,
+    vertices: Cloud | list[SurfacePoint],
+    triangles: Mesh | list[Triangle],
 ) -> Surface:
-    cumulative_areas = []
-    total_area = 0.0
-    for triangle in triangles:
-        total_area += triangle.area
-        cumulative_areas.append(total_area)
-    return Surface(sdf, vertices, triangles, cumulative_areas)
+    mesh = as_mesh(triangles)
+    return Surface(sdf, as_cloud(vertices), mesh, np.cumsum(mesh.areas))
 
 
-def stipple(surface: Surface, num_points: int, num_iters: int) -> list[SurfacePoint]:
-    points = [surface.get_random_point() for _ in range(num_points)]
+@instrument.timed("stipple")
+def stipple(
+    surface: Surface,
+    num_points: int,
+    num_iters: int,
+    batch_size: int | None = None,
+    rng: np.random.Generator | None = None,
+) -> Cloud:
+    """Spread `num_points` points evenly over the surface.
+
+    Each of the `num_iters` random targets pulls its nearest point towards it,
+    by less the more often that point has moved already. Nearest points are
+    found with a `Grid` that follows the moved points.
+
+    With `batch_size`, targets are drawn `batch_size` at a time and not
+    projected; every point moves to the running mean of all targets assigned to
+    it so far (a Lloyd-like update) and all moved points are reprojected together
+    once per batch.
+    """
+    if batch_size is not None:
+        return _stipple_batched(surface, num_points, num_iters, batch_size, rng)
+    initial = [surface.get_random_point() for _ in range(num_points)]
+    points = [p.point for p in initial]
+    normals = [p.normal for p in initial]
+    grid = Grid(sqrt(surface.cumulative_areas[-1] / num_points))
+    for i, point in enumerate(points):
+        grid.insert(i, point)
     num_moved = [0 for _ in range(num_points)]
     for iter in range(num_iters):
-        if iter % num_points == 0:
-            print(
-                f"Stippling iteration {iter}/{num_iters}, min moves {min(num_moved)}, max moves {max(num_moved)}"
+        if iter % num_points == 0 and instrument.enabled():
+            instrument.progress(
+                "stipple",
+                iter,
+                num_iters,
+                min_moves=min(num_moved),
+                max_moves=max(num_moved),
             )
         target = surface.get_random_point()
-        min_dist = float("inf")
-        min_idx = None
-        for i, point in enumerate(points):
-            d = dist(target.point, point.point)
-            if d < min_dist:
-                min_dist = d
-                min_idx = i
+        min_idx = grid.nearest(target.point)
         num_moved[min_idx] += 1
         new_point = add_mul(
-            points[min_idx].point,
-            vec(points[min_idx].point, target.point),
+            points[min_idx],
+            vec(points[min_idx], target.point),
             1 / (1 + num_moved[min_idx]),
         )
-        points[min_idx] = project_to_surface(
-            surface.sdf, p=new_point, direction=(1, 0, 0)
+        points[min_idx], normals[min_idx] = project(surface.sdf, new_point)
+        grid.move(min_idx, points[min_idx])
+    return make_cloud(
+        surface.sdf, np.array(points), np.array(normals), direction=(1, 0, 0)
+    )
+
+
+def _stipple_batched(
+    surface: Surface,
+    num_points: int,
+    num_iters: int,
+    batch_size: int,
+    rng: np.random.Generator | None,
+) -> Cloud:
+    if rng is None:
+        rng = np.random.default_rng()
+    projection = project_many(surface.sdf, surface.get_random_points(num_points, rng))
+    if not projection.converged.all():
+        raise ValueError("Could not project point to surface")
+    positions = projection.points
+    normals = projection.normals
+    num_moved = np.zeros(num_points, dtype=np.int64)
+    # Bound the (targets x points) distance matrix to a few million entries.
+    chunk = max(1, 4_000_000 // num_points)
+    for start in range(0, num_iters, batch_size):
+        if instrument.enabled():
+            instrument.progress(
+                "stipple",
+                start,
+                num_iters,
+                min_moves=num_moved.min(),
+                max_moves=num_moved.max(),
+            )
+        targets = surface.get_random_points(min(batch_size, num_iters - start), rng)
+        nearest = np.concatenate(
+            [
+                np.argmin(
+                    (
+                        (targets[i : i + chunk, None, :] - positions[None, :, :]) ** 2
+                    ).sum(axis=2),
+                    axis=1,
+                )
+                for i in range(0, len(targets), chunk)
+            ]
+        )
+        counts = np.bincount(nearest, minlength=num_points)
+        sums = np.zeros_like(positions)
+        np.add.at(sums, nearest, targets)
+        moved = np.flatnonzero(counts)
+        weights = (1 + num_moved[moved])[:, None]
+        positions[moved] = (positions[moved] * weights + sums[moved]) / (
+            weights + counts[moved, None]
         )
-    return points
+        num_moved += counts
+        projection = project_many(surface.sdf, positions[moved])
+        if not projection.converged.all():
+            raise ValueError("Could not project point to surface")
+        positions[moved] = projection.points
+        normals[moved] = projection.normals
+    return make_cloud(surface.sdf, positions, normals, direction=(1, 0, 0))
+
+
+@instrument.timed("poisson_disk")
+def poisson_disk(
+    surface: Surface,
+    *,
+    num_points: int | None = None,
+    spacing: float | None = None,
+    rng: np.random.Generator | int | None = None,
+    batch_size: int | None = None,
+    min_accepted: float = 0.01,
+) -> Cloud:
+    """Blue noise points on the surface, at least `spacing` apart, by dart throwing.
+
+    Give either `spacing` or `num_points`. Darts are drawn `batch_size` at a time
+    with `Surface.get_random_points` and rejected if they are within `spacing` of
+    an accepted point or of an earlier dart of the same batch. With `spacing`,
+    throwing stops once a batch adds fewer than `min_accepted` times the points
+    accepted so far. With `num_points`, the spacing starts where random darts
+    saturate the area and shrinks whenever that happens before enough points
+    are accepted.
+
+    Points are projected onto the SDF once at the end, which moves them by about
+    the distance between the mesh and the surface, so spacings hold up to that.
+    """
+    if (num_points is None) == (spacing is None):
+        raise ValueError("Pass exactly one of num_points and spacing")
+    rng = np.random.default_rng(rng)
+    area = surface.cumulative_areas[-1]
+    target = inf
+    if num_points is not None:
+        target = num_points
+        spacing = sqrt(4 * SATURATED_COVERAGE * area / (pi * num_points))
+    expected = 4 * SATURATED_COVERAGE * area / (pi * spacing**2)
+    if batch_size is None:
+        batch_size = max(64, int(expected) // 4)
+    points = np.zeros((0, 3))
+    while len(points) < target:
+        darts = surface.get_random_points(batch_size, rng)
+        ok = np.ones(len(darts), dtype=bool)
+        ok[pairs_between(points, darts, spacing)[1]] = False
+        ok[pairs_within(darts, spacing)[1]] = False
+        accepted = darts[ok][: max(0, min(len(darts), target - len(points)))]
+        points = np.concatenate([points, accepted])
+        instrument.progress("poisson_disk", len(points), num_points, spacing=spacing)
+        if len(accepted) < min_accepted * len(points):
+            if num_points is None:
+                break
+            spacing *= 0.95
+    projection = project_many(surface.sdf, points)
+    if not projection.converged.all():
+        raise ValueError("Could not project point to surface")
+    return make_cloud(
+        surface.sdf, projection.points, projection.normals, direction=(1, 0, 0)
+    )
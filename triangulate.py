@@ -1,8 +1,15 @@
+from collections import deque
 from dataclasses import dataclass
 from math import dist, hypot
+from typing import Iterator
+
+import numpy as np
 
 from point import Point, vec, dot, cross, normalize
 from geo import SurfacePoint
+from grid import Grid
+from cloud import Cloud, as_cloud
+import instrument
 
 
 @dataclass
@@ -13,6 +20,45 @@ class Triangle:
     area: float
 
 
+@dataclass
+class Mesh:
+    """Triangles as an (M, 3) int32 array of vertex indices and their areas.
+
+    Indexing and iterating yield `Triangle`s built on demand.
+    """
+
+    triangles: np.ndarray
+    areas: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.triangles)
+
+    def __getitem__(self, i: int) -> Triangle:
+        a, b, c = self.triangles[i].tolist()
+        return Triangle(a, b, c, float(self.areas[i]))
+
+    def __iter__(self) -> Iterator[Triangle]:
+        return (self[i] for i in range(len(self)))
+
+    def edges(self) -> np.ndarray:
+        """The (E, 2) unique edges, smaller index first, sorted."""
+        t = self.triangles
+        pairs = np.concatenate([t[:, [0, 1]], t[:, [1, 2]], t[:, [2, 0]]])
+        return np.unique(np.sort(pairs, axis=1), axis=0)
+
+
+def as_mesh(triangles: Mesh | list[Triangle]) -> Mesh:
+    """`triangles` as a `Mesh`, copying a list of `Triangle`s into arrays."""
+    if isinstance(triangles, Mesh):
+        return triangles
+    return Mesh(
+        np.array(
+            [(t.a_idx, t.b_idx, t.c_idx) for t in triangles], dtype=np.int32
+        ).reshape(-1, 3),
+        np.array([t.area for t in triangles], dtype=float),
+    )
+
+
 def is_point_on_other_side(
     p: Point, edge_a: Point, edge_b: Point, one_side: Point
 ) -> bool:
@@ -21,13 +67,15 @@ def is_point_on_other_side(
     return dot(one_normal, this_normal) < 0
 
 
-def triangulate(
-    pts: list[SurfacePoint], near_dist: float
-) -> list[Triangle]:
-    rightmost_point_index = max(range(len(pts)), key=lambda i: pts[i].point[0])
+@instrument.timed("triangulate")
+def triangulate(cloud: Cloud | list[SurfacePoint], near_dist: float) -> Mesh:
+    cloud = as_cloud(cloud)
+    pts = [tuple(p) for p in cloud.positions.tolist()]
+    normals = [tuple(n) for n in cloud.normals.tolist()]
+    rightmost_point_index = max(range(len(pts)), key=lambda i: pts[i][0])
     next_rightmost_point_index = max(
         (i for i in range(len(pts)) if i != rightmost_point_index),
-        key=lambda i: pts[i].point[0],
+        key=lambda i: pts[i][0],
         default=None,
     )
     third_rightmost_point_index = max(
@@ -36,38 +84,47 @@ def triangulate(
             for i in range(len(pts))
             if i != rightmost_point_index and i != next_rightmost_point_index
         ),
-        key=lambda i: pts[i].point[0],
+        key=lambda i: pts[i][0],
         default=None,
     )
 
-    triangles = []
+    grid = Grid(near_dist)
+    for i, pt in enumerate(pts):
+        grid.insert(i, pt)
+
+    triangles: list[tuple[int, int, int]] = []
+    areas: list[float] = []
     edge_to_other_side: dict[tuple[int, int], int] = {}
-    edges_to_do = []
+    # The front is a queue in insertion order; edges closed before being popped
+    # are only dropped from `front` and skipped when they reach the head.
+    edges_to_do: deque[tuple[int, int]] = deque()
+    front: set[tuple[int, int]] = set()
 
     def make_edge(a: int, b: int) -> tuple[int, int]:
         return (min(a, b), max(a, b))
 
     def add_edge(a: int, b: int, other_side: int) -> None:
         edge = make_edge(a, b)
-        if edge in edges_to_do:
-            edges_to_do.remove(edge)
+        if edge in front:
+            front.remove(edge)
             return
         if edge in edge_to_other_side:
             return
         edge_to_other_side[edge] = other_side
+        front.add(edge)
         edges_to_do.append(edge)
 
     def add_triangle(a: int, b: int, c: int) -> None:
         add_edge(a, b, c)
         add_edge(b, c, a)
         add_edge(c, a, b)
-        side_a = vec(pts[b].point, pts[c].point)
-        side_b = vec(pts[a].point, pts[c].point)
-        area = hypot(*cross(side_a, side_b)) / 2
-        if dot(pts[c].normal, cross(side_a, side_b)) < 0:
-            triangles.append(Triangle(a, b, c, area))
+        side_a = vec(pts[b], pts[c])
+        side_b = vec(pts[a], pts[c])
+        areas.append(hypot(*cross(side_a, side_b)) / 2)
+        if dot(normals[c], cross(side_a, side_b)) < 0:
+            triangles.append((a, b, c))
         else:
-            triangles.append(Triangle(b, a, c, area))
+            triangles.append((b, a, c))
 
     def triangle_exists(a: int, b: int, c: int) -> bool:
         return (
@@ -79,14 +136,17 @@ def triangulate(
     add_triangle(
         rightmost_point_index, next_rightmost_point_index, third_rightmost_point_index
     )
-    while edges_to_do:
-        edge = edges_to_do.pop(0)
-        # print(f"Num triangles: {len(triangles)}, edges remaining: {len(edges_to_do)}")
+    while front:
+        edge = edges_to_do.popleft()
+        if edge not in front:
+            continue
+        front.remove(edge)
+        instrument.record("triangulate.front", len(front))
         a_idx, b_idx = edge
         other_side_idx = edge_to_other_side.get(edge)
-        a = pts[a_idx].point
-        b = pts[b_idx].point
-        c = pts[other_side_idx].point
+        a = pts[a_idx]
+        b = pts[b_idx]
+        c = pts[other_side_idx]
 
         smallest_dot_product = None
         best_idx = None
@@ -94,8 +154,10 @@ def triangulate(
         pts_considered = 0
         pts_on_other_side = 0
         triangle_points_skipped = 0
-        for i, d_sfpt in enumerate(pts):
-            d = d_sfpt.point
+        nearby = set(grid.candidates(a, near_dist))
+        nearby.update(grid.candidates(b, near_dist))
+        for i in sorted(nearby):
+            d = pts[i]
             if i == a_idx or i == b_idx or i == other_side_idx:
                 continue
             if not (dist(d, a) < near_dist or dist(d, b) < near_dist):
@@ -110,12 +172,12 @@ def triangulate(
                 if smallest_dot_product is None or cos_angle < smallest_dot_product:
                     smallest_dot_product = cos_angle
                     best_idx = i
-        # print(
-        #     f"Considered {pts_considered} points, {pts_on_other_side} on other side, {triangle_points_skipped=}"
-        # )
+        instrument.record("triangulate.candidates", pts_considered)
         if best_idx is not None:
             add_triangle(a_idx, b_idx, best_idx)
         else:
             raise RuntimeError("No next point found for edge")
 
-    return triangles
+    return Mesh(
+        np.array(triangles, dtype=np.int32).reshape(-1, 3), np.array(areas, dtype=float)
+    )
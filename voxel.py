@@ -0,0 +1,283 @@
+from dataclasses import dataclass, field
+from math import ceil, sqrt
+
+import numpy as np
+
+from point import Point
+from sdf import SDF, Bound, bound, evaluate
+from sdf import _evaluate, _evaluate_gradient, _value_and_gradient
+
+# Corner offsets of a cell in (dx, dy, dz) order, matching reshape(2, 2, 2).
+CORNERS = np.array(
+    [(dx, dy, dz) for dx in (0, 1) for dy in (0, 1) for dz in (0, 1)], dtype=np.int64
+)
+
+
+def interpolate(
+    corners: np.ndarray, frac: np.ndarray, h: float
+) -> tuple[np.ndarray, np.ndarray]:
+    """Trilinear value and gradient from (N, 8) corner values.
+
+    `frac` are the (N, 3) positions within the cells in units of the cell size
+    `h`.
+    """
+    c = corners.reshape(-1, 2, 2, 2)
+    fx = frac[:, 0, None, None]
+    fy = frac[:, 1, None]
+    fz = frac[:, 2]
+    # Collapse one axis at a time, keeping the differences for the gradient.
+    cx = c[:, 0] * (1 - fx) + c[:, 1] * fx
+    dx = c[:, 1] - c[:, 0]
+    cxy = cx[:, 0] * (1 - fy) + cx[:, 1] * fy
+    dy = cx[:, 1] - cx[:, 0]
+    dxy = dx[:, 0] * (1 - fy) + dx[:, 1] * fy
+    value = cxy[:, 0] * (1 - fz) + cxy[:, 1] * fz
+    gx = dxy[:, 0] * (1 - fz) + dxy[:, 1] * fz
+    gy = dy[:, 0] * (1 - fz) + dy[:, 1] * fz
+    gz = cxy[:, 1] - cxy[:, 0]
+    return value, np.stack([gx, gy, gz], axis=1) / h
+
+
+def interpolate_point(
+    c: list, fx: float, fy: float, fz: float, h: float
+) -> tuple[float, Point]:
+    """Scalar `interpolate` of the corners `c`, nested [dx][dy][dz] lists."""
+    (c000, c001), (c010, c011) = c[0]
+    (c100, c101), (c110, c111) = c[1]
+    cx00 = c000 + (c100 - c000) * fx
+    cx01 = c001 + (c101 - c001) * fx
+    cx10 = c010 + (c110 - c010) * fx
+    cx11 = c011 + (c111 - c011) * fx
+    dx0 = (c100 - c000) + ((c110 - c010) - (c100 - c000)) * fy
+    dx1 = (c101 - c001) + ((c111 - c011) - (c101 - c001)) * fy
+    cxy0 = cx00 + (cx10 - cx00) * fy
+    cxy1 = cx01 + (cx11 - cx01) * fy
+    dy0 = cx10 - cx00
+    dy1 = cx11 - cx01
+    value = cxy0 + (cxy1 - cxy0) * fz
+    grad = (
+        (dx0 + (dx1 - dx0) * fz) / h,
+        (dy0 + (dy1 - dy0) * fz) / h,
+        (cxy1 - cxy0) / h,
+    )
+    return value, grad
+
+
+@dataclass
+class VoxelCache:
+    """An SDF sampled once into a two-level grid over the box `lo`..`hi`.
+
+    The coarse grid has spacing `cell_size`. Coarse cells within `band` of the
+    zero level set additionally get a brick of `refine`^3 finer cells; other
+    cells only interpolate the coarse samples. Lookups interpolate
+    trilinearly. The exact SDF is evaluated instead outside the box, where the
+    cached value is within `exact_band` of zero, and in bricks whose measured
+    interpolation error exceeds `tolerance`. `error` is the largest error seen
+    at the cell centers while building, an estimate of the worst case
+    elsewhere, not a bound; `exact_band` defaults to twice it.
+
+    `margin` is what `bound` adds to the radius. Interpolated values are
+    averages of corners within a cell diagonal, so for an SDF whose gradient is
+    at most 1 they are off by less than the diagonal; twice `error` is added
+    for SDFs that are steeper.
+    """
+
+    sdf: SDF
+    lo: Point
+    hi: Point
+    cell_size: float
+    band: float
+    refine: int = 4
+    tolerance: float | None = None
+    exact_band: float | None = None
+    shape: tuple[int, int, int] = field(init=False, repr=False, compare=False)
+    coarse: np.ndarray = field(init=False, repr=False, compare=False)
+    brick_index: np.ndarray = field(init=False, repr=False, compare=False)
+    bricks: np.ndarray = field(init=False, repr=False, compare=False)
+    brick_exact: np.ndarray = field(init=False, repr=False, compare=False)
+    error: float = field(init=False, repr=False, compare=False)
+    margin: float = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        h = self.cell_size
+        lo = np.asarray(self.lo, dtype=float)
+        self.shape = tuple(max(1, ceil((b - a) / h)) for a, b in zip(self.lo, self.hi))
+        axes = [lo[i] + h * np.arange(self.shape[i] + 1) for i in range(3)]
+        nodes = np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1)
+        self.coarse = evaluate(self.sdf, nodes.reshape(-1, 3)).reshape(nodes.shape[:3])
+
+        cells = np.stack(
+            np.meshgrid(*(np.arange(n) for n in self.shape), indexing="ij"), axis=-1
+        ).reshape(-1, 3)
+        corner_values = self.corner_values(self.coarse, cells)
+        near = np.abs(corner_values).min(axis=1) < self.band + h * sqrt(3)
+        self.brick_index = np.full(self.shape, -1, dtype=np.int64)
+        brick_cells = cells[near]
+        self.brick_index[tuple(brick_cells.T)] = np.arange(len(brick_cells))
+
+        r = self.refine
+        fine = np.arange(r + 1) * (h / r)
+        offsets = np.stack(np.meshgrid(fine, fine, fine, indexing="ij"), axis=-1)
+        origins = lo + brick_cells * h
+        samples = origins[:, None, None, None, :] + offsets[None]
+        self.bricks = evaluate(self.sdf, samples.reshape(-1, 3)).reshape(
+            len(brick_cells), r + 1, r + 1, r + 1
+        )
+
+        # Measure the interpolation error at the centers of all cells.
+        coarse_error = np.abs(
+            interpolate(corner_values, np.full((len(cells), 3), 0.5), h)[0]
+            - evaluate(self.sdf, lo + (cells + 0.5) * h)
+        )
+        fine_cells = np.stack(
+            np.meshgrid(*(np.arange(r),) * 3, indexing="ij"), axis=-1
+        ).reshape(-1, 3)
+        centers = (fine_cells + 0.5) * (h / r)
+        exact = evaluate(
+            self.sdf, (origins[:, None, :] + centers[None]).reshape(-1, 3)
+        ).reshape(len(brick_cells), -1)
+        idx = fine_cells[:, None, :] + CORNERS[None]
+        fine_corners = self.bricks[:, idx[..., 0], idx[..., 1], idx[..., 2]]
+        approx = interpolate(
+            fine_corners.reshape(-1, 8), np.full((exact.size, 3), 0.5), h / r
+        )[0]
+        brick_error = np.abs(approx.reshape(exact.shape) - exact).max(
+            axis=1, initial=0.0
+        )
+        if self.tolerance is None:
+            self.brick_exact = np.zeros(len(brick_cells), dtype=bool)
+        else:
+            self.brick_exact = brick_error > self.tolerance
+        coarse_error[near] = 0.0
+        self.error = float(
+            max(
+                coarse_error.max(initial=0.0),
+                brick_error[~self.brick_exact].max(initial=0.0),
+            )
+        )
+        if self.exact_band is None:
+            self.exact_band = 2 * self.error
+        self.margin = 2 * self.error + h * sqrt(3)
+
+    @staticmethod
+    def corner_values(grid: np.ndarray, cells: np.ndarray) -> np.ndarray:
+        idx = cells[:, None, :] + CORNERS[None]
+        return grid[idx[..., 0], idx[..., 1], idx[..., 2]]
+
+    def lookup(self, ps: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Interpolated values and gradients, and the rows needing exact values."""
+        h = self.cell_size
+        rel = (ps - np.asarray(self.lo, dtype=float)) / h
+        shape = np.array(self.shape)
+        inside = np.all((rel >= 0) & (rel <= shape), axis=1)
+        cells = np.clip(np.floor(rel).astype(np.int64), 0, shape - 1)
+        frac = rel - cells
+        values = np.zeros(len(ps))
+        grads = np.zeros((len(ps), 3))
+        b = np.where(inside, self.brick_index[tuple(cells.T)], -1)
+
+        rows = np.flatnonzero(inside & (b < 0))
+        values[rows], grads[rows] = interpolate(
+            self.corner_values(self.coarse, cells[rows]), frac[rows], h
+        )
+
+        rows = np.flatnonzero(b >= 0)
+        r = self.refine
+        fine_rel = frac[rows] * r
+        fine = np.clip(np.floor(fine_rel).astype(np.int64), 0, r - 1)
+        idx = fine[:, None, :] + CORNERS[None]
+        corners = self.bricks[b[rows, None], idx[..., 0], idx[..., 1], idx[..., 2]]
+        values[rows], grads[rows] = interpolate(corners, fine_rel - fine, h / r)
+
+        exact = ~inside | (np.abs(values) < self.exact_band)
+        exact[rows] |= self.brick_exact[b[rows]]
+        return values, grads, np.flatnonzero(exact)
+
+    def lookup_point(self, p: Point) -> tuple[float, Point] | None:
+        """`lookup` of one point in plain Python; None if it needs the exact SDF.
+
+        Wrapping a single point in an array for `lookup` costs far more than
+        interpolating it directly.
+        """
+        h = self.cell_size
+        x, y, z = p
+        x0, y0, z0 = self.lo
+        nx, ny, nz = self.shape
+        fx, fy, fz = (x - x0) / h, (y - y0) / h, (z - z0) / h
+        if not (0 <= fx <= nx and 0 <= fy <= ny and 0 <= fz <= nz):
+            return None
+        i, j, k = min(int(fx), nx - 1), min(int(fy), ny - 1), min(int(fz), nz - 1)
+        fx, fy, fz = fx - i, fy - j, fz - k
+        b = self.brick_index.item(i, j, k)
+        if b < 0:
+            corners = self.coarse[i : i + 2, j : j + 2, k : k + 2].tolist()
+        else:
+            if self.brick_exact.item(b):
+                return None
+            r = self.refine
+            fx, fy, fz = fx * r, fy * r, fz * r
+            i, j, k = min(int(fx), r - 1), min(int(fy), r - 1), min(int(fz), r - 1)
+            fx, fy, fz = fx - i, fy - j, fz - k
+            corners = self.bricks[b, i : i + 2, j : j + 2, k : k + 2].tolist()
+            h /= r
+        value, grad = interpolate_point(corners, fx, fy, fz, h)
+        if abs(value) < self.exact_band:
+            return None
+        return value, grad
+
+    def __call__(self, p: Point) -> float:
+        cached = self.lookup_point(p)
+        return self.sdf(p) if cached is None else cached[0]
+
+    def batch(self, ps: np.ndarray) -> np.ndarray:
+        values, _, exact = self.lookup(ps)
+        values[exact] = _evaluate(self.sdf, ps[exact])
+        return values
+
+    def gradient(self, p: Point) -> tuple[float, Point]:
+        cached = self.lookup_point(p)
+        return _value_and_gradient(self.sdf, p) if cached is None else cached
+
+    def batch_gradient(self, ps: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        values, grads, exact = self.lookup(ps)
+        values[exact], grads[exact] = _evaluate_gradient(self.sdf, ps[exact])
+        return values, grads
+
+    def bound(self) -> Bound | None:
+        b = bound(self.sdf)
+        return b and Bound(b.center, b.radius + self.margin)
+
+
+def voxelize(
+    sdf: SDF,
+    cell_size: float,
+    *,
+    band: float | None = None,
+    lo: Point | None = None,
+    hi: Point | None = None,
+    refine: int = 4,
+    tolerance: float | None = None,
+    exact_band: float | None = None,
+) -> SDF:
+    """Cache `sdf` in a `VoxelCache`.
+
+    The box defaults to the bounding sphere of `sdf` grown by one cell, and the
+    narrow band to one coarse cell.
+    """
+    if lo is None or hi is None:
+        b = bound(sdf)
+        if b is None:
+            raise ValueError("SDF has no bound, pass lo and hi")
+        r = b.radius + cell_size
+        lo = tuple(c - r for c in b.center)
+        hi = tuple(c + r for c in b.center)
+    return VoxelCache(
+        sdf,
+        lo,
+        hi,
+        cell_size,
+        cell_size if band is None else band,
+        refine,
+        tolerance,
+        exact_band,
+    )